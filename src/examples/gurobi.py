@@ -6,12 +6,12 @@ from future.builtins import object, dict, range
 
 import sys
 import math
+import collections
 
 import gurobipy
 import rr.opt.mcts.simple as mcts
 
 
-random = mcts.random
 mcts.config_logging(level="DEBUG")
 logger = mcts.logger
 info = logger.info
@@ -64,9 +64,59 @@ def set_var_bounds(domains):
 
 
 def solve_lp(model, domains):
+    """Solve the LP relaxation with the given domains. Returns a (feasible, objective value,
+    {IntVarData: value}) tuple, where the values are those of the integer variables in `domains`.
+    """
     set_var_bounds(domains)
     model.optimize()
-    return model.status == gurobipy.GRB.Status.OPTIMAL
+    if model.status != gurobipy.GRB.Status.OPTIMAL:
+        return (False, None, None)
+    return (True, model.objVal, {vdata: vdata.var.x for vdata in domains.keys()})
+
+
+class LpCache(object):
+    """Bounded LRU cache of LP outcomes, keyed by the domains of all integer variables (and also
+    by the variable and direction of the probing LPs in :meth:`MipTreeNode.propagate`). Dives in
+    :meth:`MipTreeNode.simulate` often reach the same domains, whose LPs then need not be solved
+    again. Since the gurobi model is not re-solved on hits, variable values must be taken from
+    the cached outcomes (see ``MipTreeNode.lp_x``) rather than from the model's variables.
+    """
+
+    def __init__(self, int_vars, maxsize):
+        self.int_vars = int_vars  # IntVarData objects, in a fixed order
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()  # least recently used entries come first
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return "LpCache(size={}, hits={}, misses={}, hit_rate={:.1%})".format(
+            len(self.entries), self.hits, self.misses, self.hit_rate)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def key(self, domains, *extra):
+        return tuple(domains[vdata] for vdata in self.int_vars) + extra
+
+    def get(self, key):
+        """Return the outcome stored for `key` (a tuple), or None if it is not in the cache."""
+        try:
+            outcome = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = outcome  # reinserted as the most recently used entry
+        self.hits += 1
+        return outcome
+
+    def put(self, key, outcome):
+        entries = self.entries
+        entries[key] = outcome
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
 
 
 class IntVarData(object):
@@ -87,6 +137,8 @@ class IntVarData(object):
 
 
 class MipTreeNode(mcts.TreeNode):
+    LP_CACHE_SIZE = 100000  # maximum number of LP outcomes kept in the cache
+
     @classmethod
     def root(cls, filename):
         root = cls()
@@ -97,6 +149,7 @@ class MipTreeNode(mcts.TreeNode):
         root.relaxed = []  # *node* free vars :: [IntVarData]
         root.upper_bound = None  # *node* upper bound :: float | Infeasible
         root.lower_bound = None  # *node* lower bound :: float | Infeasible
+        root.lp_x = None  # *node* int var values in the LP relaxation :: {IntVarData: float}
 
         # collect integer variables and relax them
         for var in root.model.getVars():
@@ -113,12 +166,13 @@ class MipTreeNode(mcts.TreeNode):
         info("model has {} vars ({} int)".format(root.model.NumVars, root.model.NumIntVars))
         info("int vars: {}".format([vd.name for vd in root.relaxed]))
         assert len(root.domains) == len(root.relaxed) == root.model.NumIntVars
+        root.lp_cache = LpCache(list(root.relaxed), cls.LP_CACHE_SIZE)  # *shared* :: LpCache
 
         root.propagate()  # reduce domains and fix any singleton variables
         root.solve_relaxation()  # solve root relaxation to determine bound
         info("ROOT RELAXATION:")
         for vdata in root.domains.keys():
-            info("\t{}: {}".format(vdata.name, vdata.var.x))
+            info("\t{}: {}".format(vdata.name, root.lp_x[vdata]))
         return root
 
     def fixed(self):
@@ -140,17 +194,19 @@ class MipTreeNode(mcts.TreeNode):
         clone = mcts.TreeNode.copy(self)
         # global data (shallow-copied)
         clone.model = self.model
+        clone.lp_cache = self.lp_cache
         # local data (which must be copied)
         clone.domains = dict(self.domains)
         clone.relaxed = list(self.relaxed)
         clone.upper_bound = self.upper_bound
         clone.lower_bound = self.lower_bound
+        clone.lp_x = self.lp_x  # never modified in place
         return clone
 
     def branches(self):
         if len(self.relaxed) == 0:
             return []
-        vdata = random.choice(self.relaxed)
+        vdata = self.rng.choice(self.relaxed)
         lb, ub = self.domains[vdata]
         return [(vdata, value) for value in range(lb, ub + 1)]
 
@@ -168,15 +224,23 @@ class MipTreeNode(mcts.TreeNode):
             assert len(self.relaxed) == 0
 
     def solve_relaxation(self):
-        # solve linear relaxation to find a lower bound for the node
-        if solve_lp(self.model, self.domains):
-            self.lower_bound = self.model.objVal
+        # solve linear relaxation to find a lower bound for the node (unless it is cached)
+        cache = self.lp_cache
+        key = cache.key(self.domains)
+        outcome = cache.get(key)
+        if outcome is None:
+            outcome = solve_lp(self.model, self.domains)
+            cache.put(key, outcome)
+        feasible, obj_val, lp_x = outcome
+        if feasible:
+            self.lower_bound = obj_val
+            self.lp_x = lp_x
             # if all unfixed variables have integral values, we have a full solution
-            if all(is_integral(vd.var.x) for vd in self.relaxed):
+            if all(is_integral(lp_x[vd]) for vd in self.relaxed):
                 for vdata in self.relaxed:
-                    self.domains[vdata] = (vdata.var.x, vdata.var.x)
+                    self.domains[vdata] = (lp_x[vdata], lp_x[vdata])
                 self.relaxed = []
-                self.upper_bound = self.model.objVal
+                self.upper_bound = obj_val
         # otherwise we set an Infeasible as upper bound and make the node a leaf
         else:
             self.lower_bound = mcts.Infeasible(len(self.relaxed))
@@ -189,10 +253,11 @@ class MipTreeNode(mcts.TreeNode):
             return mcts.Solution(value=self.upper_bound, data=self.fixed())
         node = self.copy()
         node.solve_relaxation()  # determine variable values in initial LP
+        rng = self.rng
         while len(node.relaxed) > 0:
-            vdata = random.choice(node.relaxed)
-            value = vdata.var.x
-            if random.random() < value - math.floor(value):
+            vdata = rng.choice(node.relaxed)
+            value = node.lp_x[vdata]
+            if rng.random() < value - math.floor(value):
                 value = int(math.ceil(value))
             else:
                 value = int(math.floor(value))
@@ -202,6 +267,23 @@ class MipTreeNode(mcts.TreeNode):
     def bound(self):
         return self.lower_bound
 
+    def probe(self, vdata, sense):
+        """Optimize a variable in the LP relaxation with the node's domains (which must also be
+        set in the model), in the direction given by `sense`. Returns the variable's optimal value,
+        or None if the relaxation is infeasible. Note that the model's objective is changed.
+        """
+        cache = self.lp_cache
+        key = cache.key(self.domains, vdata.name, sense)
+        outcome = cache.get(key)
+        if outcome is None:
+            model = self.model
+            model.setObjective(vdata.var, sense)
+            model.optimize()
+            feasible = model.status == gurobipy.GRB.Status.OPTIMAL
+            outcome = (feasible, vdata.var.X if feasible else None)
+            cache.put(key, outcome)
+        return outcome[1]
+
     def propagate(self):
         set_var_bounds(self.domains)
         model = self.model
@@ -213,16 +295,14 @@ class MipTreeNode(mcts.TreeNode):
             fixed = []
             for vdata in self.relaxed:
                 var = vdata.var
-                model.setObjective(var, gurobipy.GRB.MAXIMIZE)
-                model.optimize()
-                if model.status != gurobipy.GRB.Status.OPTIMAL:
+                ub = self.probe(vdata, gurobipy.GRB.MAXIMIZE)
+                if ub is None:
                     feasible = False
                     break
-                ub = int(math.floor(var.X + EPS))
-                model.setObjective(var, gurobipy.GRB.MINIMIZE)
-                model.optimize()
-                assert model.status == gurobipy.GRB.Status.OPTIMAL
-                lb = int(math.ceil(var.X - EPS))
+                ub = int(math.floor(ub + EPS))
+                lb = self.probe(vdata, gurobipy.GRB.MINIMIZE)
+                assert lb is not None
+                lb = int(math.ceil(lb - EPS))
                 if lb > ub:
                     feasible = False
                     break
@@ -252,6 +332,7 @@ def main(instance, niter, seed):
     root = MipTreeNode.root(instance)
     sols = mcts.run(root, iter_limit=niter, rng_seed=seed)
     info("solutions found: {}".format(sols))
+    info("LP relaxations: {}".format(root.lp_cache))
     info("best found objective: {}".format(sols.best.value))
     if sols.best.is_feas:
         info("best solution (non-zeros):")
@@ -5,11 +5,15 @@ from __future__ import unicode_literals
 from future.builtins import range
 
 import collections
-import random
 import time
 
 import rr.opt.mcts.simple as mcts
 
+try:
+    import numpy
+except ImportError:  # simulate_batch() falls back to the sequential base implementation
+    numpy = None
+
 
 Item = collections.namedtuple("Item", ["name", "value", "weight", "ratio"])
 
@@ -116,13 +120,63 @@ class KnapsackTreeNode(mcts.TreeNode):
 
     def simulate(self):
         node = self.copy()
+        rng = self.rng
         while len(node.items_left) > 0:
-            node.apply(random.choice([True, False]))  # monte carlo simulation
+            node.apply(rng.choice([True, False]))  # monte carlo simulation
         return mcts.Solution(
             value=(node.total_value * -1),  # flip objective function
             data=node.items_packed,
         )
 
+    def simulate_batch(self, n):
+        if numpy is None:
+            return mcts.TreeNode.simulate_batch(self, n)
+        # Vectorized version of the random dive in simulate(): all n dives advance one item at a
+        # time in lockstep, in the same order in which apply() would pop the items.
+        items = self.items_left[::-1]
+        weights = numpy.array([i.weight for i in items])
+        values = numpy.array([i.value for i in items])
+        rng = numpy.random.Generator(numpy.random.PCG64(self.rng.getrandbits(64)))
+        capacity_left = numpy.full(n, self.capacity_left)
+        capacity_required = numpy.full(n, self.capacity_required)
+        total_value = numpy.full(n, self.total_value)
+        packed = numpy.zeros((n, len(items)), dtype=bool)
+        done = numpy.zeros(n, dtype=bool)
+        for j, (weight, value) in enumerate(zip(weights, values)):
+            # item j is still available in dives where it fits (see filtering in apply())
+            active = ~done & (weight <= capacity_left)
+            pack = active & (rng.random(n) < 0.5)
+            capacity_required[active] -= weight
+            capacity_left[pack] -= weight
+            total_value[pack] += value
+            packed[pack, j] = True
+            weights_rest = weights[j+1:]
+            if pack.any():
+                fits = weights_rest <= capacity_left[pack, None]
+                capacity_required[pack] = fits.dot(weights_rest)
+            # pack everything that is left if it fits in the knapsack
+            finish = active & (capacity_required <= capacity_left)
+            if finish.any():
+                fits = weights_rest <= capacity_left[finish, None]
+                total_value[finish] += fits.dot(values[j+1:])
+                capacity_left[finish] -= fits.dot(weights_rest)
+                packed[finish, j+1:] = fits
+                done |= finish
+        best = total_value.argmax()
+        worst = total_value.argmin()
+        batch = mcts.Solutions(
+            self._batch_solution(best, total_value, packed, items),
+            self._batch_solution(worst, total_value, packed, items),
+        )
+        batch.feas_count = n  # all dives are feasible, but only the extremes are materialized
+        return batch
+
+    def _batch_solution(self, k, total_value, packed, items):
+        return mcts.Solution(
+            value=int(total_value[k]) * -1,  # flip objective function
+            data=self.items_packed + [items[j] for j in numpy.flatnonzero(packed[k])],
+        )
+
     def bound(self):
         if self.upper_bound is None:
             bound = self.total_value
@@ -143,6 +197,7 @@ def main():
         print("_" * 100)
         print(instance_fnc.__name__)
         verify_instance(instance_fnc, rng_seed=int(time.time()*1000))
+        verify_instance(instance_fnc, rng_seed=int(time.time()*1000), sim_batch_size=16)
 
 
 if __name__ == "__main__":
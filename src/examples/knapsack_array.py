@@ -0,0 +1,323 @@
+"""High-performance variant of the knapsack example, suitable for instances with many thousands of
+items. Item data is stored only once, in NumPy arrays (sorted by decreasing value-to-weight ratio)
+shared by all nodes, and each node is reduced to a handful of scalars: the index of the next item
+to consider, the remaining capacity, the total packed value, and a bitset of packed items. Prefix
+sums over the sorted arrays give O(1) state transitions and an O(log n) fractional bound.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+from functools import partial
+
+import numpy
+import rr.opt.mcts.simple as mcts
+from rr.opt.mcts import parallel
+
+from examples import knapsack
+
+
+class KnapsackData(object):
+    """Read-only instance data shared by all nodes of a search tree. For multi-process searches,
+    :meth:`share` moves the arrays into shared memory, so that worker processes attach to the same
+    data instead of receiving a copy.
+    """
+    ARRAYS = ("order", "values", "weights", "value_sums", "weight_sums", "weight_mins")
+
+    def __init__(self, values, weights, capacity):
+        values = numpy.asarray(values, dtype=numpy.int64)
+        weights = numpy.asarray(weights, dtype=numpy.int64)
+        assert values.shape == weights.shape
+        order = numpy.argsort(-values / weights, kind="mergesort")  # decreasing ratio
+        self.n = len(order)
+        self.capacity = int(capacity)
+        self.order = order  # original index of each item in sorted order
+        self.values = values[order]
+        self.weights = weights[order]
+        # prefix sums: value_sums[j] is the total value of items 0..j-1 (in sorted order)
+        self.value_sums = numpy.concatenate([[0], numpy.cumsum(self.values)])
+        self.weight_sums = numpy.concatenate([[0], numpy.cumsum(self.weights)])
+        # suffix minima: weight_mins[j] is the weight of the lightest item in j..n-1
+        self.weight_mins = numpy.minimum.accumulate(
+            numpy.concatenate([self.weights, [self.capacity + 1]])[::-1]
+        )[::-1]
+        self.shared = None  # {array name: SharedArray} after share()
+
+    def share(self):
+        """Move the arrays into shared memory (see :class:`rr.opt.mcts.parallel.SharedArray`). Once
+        shared, pickling this object only copies small handles to the arrays. The process that
+        calls this method must call :meth:`unlink` when the data is no longer needed.
+        """
+        if self.shared is None:
+            self.shared = {}
+            for name in self.ARRAYS:
+                self.shared[name] = parallel.SharedArray.create(getattr(self, name))
+                setattr(self, name, self.shared[name].view())
+        return self
+
+    def unlink(self):
+        for name, shared in self.shared.items():
+            setattr(self, name, None)
+            shared.unlink()
+        self.shared = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.shared is not None:
+            for name in self.ARRAYS:
+                del state[name]  # attached to the shared arrays on unpickling
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared is not None:
+            for name in self.ARRAYS:
+                setattr(self, name, self.shared[name].view())
+
+    def unpack(self, packed):
+        """Convert a bitset of packed items (in sorted order) into a list of original indices."""
+        bits = bin(packed)[:1:-1]  # bits[j] is the j-th least significant bit
+        return sorted(int(self.order[j]) for j, bit in enumerate(bits) if bit == "1")
+
+
+class ArrayKnapsackTreeNode(mcts.TreeNode):
+    @classmethod
+    def root(cls, instance):
+        # instance is either a (values, weights, capacity) tuple or a (possibly shared) KnapsackData
+        root = cls()
+        if isinstance(instance, KnapsackData):
+            root.data = instance
+        else:
+            root.data = KnapsackData(*instance)  # *shared* instance data
+        root.index = 0  # next item to consider (in sorted order)
+        root.capacity_left = root.data.capacity
+        root.total_value = 0
+        root.packed = 0  # bitset of packed items (in sorted order)
+        root.upper_bound = None
+        root.settle()
+        return root
+
+    def copy(self):
+        clone = mcts.TreeNode.copy(self)
+        clone.data = self.data
+        clone.index = self.index
+        clone.capacity_left = self.capacity_left
+        clone.total_value = self.total_value
+        clone.packed = self.packed
+        clone.upper_bound = None
+        return clone
+
+    def branches(self):
+        return (True, False) if self.index < self.data.n else ()
+
+    def apply(self, pack_item):
+        data = self.data
+        j = self.index
+        if pack_item:
+            self.capacity_left -= int(data.weights[j])
+            self.total_value += int(data.values[j])
+            self.packed |= 1 << j
+        self.index = j + 1
+        self.settle()
+
+    def settle(self):
+        """Skip items that no longer fit and detect leaves in O(1) using the prefix sums."""
+        data = self.data
+        n = data.n
+        j = self.index
+        capacity = self.capacity_left
+        if j >= n or data.weight_mins[j] > capacity:
+            self.index = n  # nothing else fits
+        elif data.weight_sums[n] - data.weight_sums[j] <= capacity:
+            # everything that is left fits: pack it all
+            self.capacity_left -= int(data.weight_sums[n] - data.weight_sums[j])
+            self.total_value += int(data.value_sums[n] - data.value_sums[j])
+            self.packed |= ((1 << n) - 1) ^ ((1 << j) - 1)
+            self.index = n
+        else:
+            weights = data.weights
+            while weights[j] > capacity:
+                j += 1
+            self.index = j
+
+    def simulate(self):
+        # Only the value of the dive is computed here. The packed items can be obtained later
+        # (if needed) by replaying the dive from the same state and seed.
+        seed = self.rng.getrandbits(64)
+        value, _ = dive(self.data, self.index, self.capacity_left, seed)
+        return mcts.Solution(
+            value=(self.total_value + value) * -1,  # flip objective function
+            make_data=partial(
+                replay_dive, self.data, self.index, self.capacity_left, self.packed, seed,
+            ),
+        )
+
+    def bound(self):
+        if self.upper_bound is None:
+            relaxation = fractional_value(self.data, self.index, self.capacity_left)
+            self.upper_bound = self.total_value + relaxation
+        return self.upper_bound * -1  # flip bound
+
+    def branch_bound(self, pack_item):
+        # The next item has the best ratio among those left and it fits, so packing it keeps the
+        # node's own bound, while skipping it removes the item from the linear relaxation.
+        if pack_item:
+            return self.bound()
+        relaxation = fractional_value(self.data, self.index + 1, self.capacity_left)
+        return (self.total_value + relaxation) * -1  # flip bound
+
+
+def fractional_value(data, index, capacity):
+    """Optimal value of the linear relaxation over items index..n-1 (in sorted order) for the
+    given capacity, computed in O(log n) using the prefix sums.
+    """
+    # k is the first item that does not fit entirely if items index..n-1 are packed in order
+    k = int(numpy.searchsorted(data.weight_sums, data.weight_sums[index] + capacity,
+                               side="right")) - 1
+    value = int(data.value_sums[k] - data.value_sums[index])
+    if k < data.n:
+        capacity -= int(data.weight_sums[k] - data.weight_sums[index])
+        value += int(data.values[k]) * capacity / int(data.weights[k])
+    return value
+
+
+def dive(data, index, capacity, seed):
+    """Simulation from a node with the given next item index and remaining capacity: first, each
+    remaining item is packed with probability 1/2 if it fits, then any items that still fit are
+    packed greedily. Returns the value gained and the (sorted order) indices of packed items.
+    """
+    rng = numpy.random.Generator(numpy.random.PCG64(seed))
+    rest = numpy.arange(index, data.n)
+    capacity, chosen = pack_in_order(data.weights, rest[rng.random(len(rest)) < 0.5], capacity)
+    unchosen = numpy.setdiff1d(rest, chosen, assume_unique=True)
+    capacity, greedy = pack_in_order(data.weights, unchosen, capacity)
+    packed = numpy.concatenate([chosen, greedy])
+    return int(data.values[packed].sum()), packed
+
+
+def replay_dive(data, index, capacity, packed, seed):
+    """Rebuild the solution data (sorted original item indices) of a previous :func:`dive`."""
+    _, dive_packed = dive(data, index, capacity, seed)
+    items = data.unpack(packed)
+    items.extend(int(i) for i in data.order[dive_packed])
+    return sorted(items)
+
+
+def pack_in_order(weights, candidates, capacity):
+    """Pack `candidates` in order, skipping those that do not fit at the time they are
+    considered. Runs of consecutive fitting items are packed in a single vectorized step.
+    Returns the remaining capacity and the indices of the packed items.
+    """
+    packed = []
+    while len(candidates) > 0:
+        candidates = candidates[weights[candidates] <= capacity]
+        cumulative = numpy.cumsum(weights[candidates])
+        fit = numpy.searchsorted(cumulative, capacity, side="right")
+        packed.append(candidates[:fit])
+        if fit > 0:
+            capacity -= int(cumulative[fit-1])
+        candidates = candidates[fit+1:]  # candidates[fit] was the first not to fit
+    packed = numpy.concatenate(packed) if len(packed) > 0 else numpy.empty(0, dtype=int)
+    return capacity, packed
+
+
+# Instance generators for the classical instance types of Pisinger (2005), "Where are the hard
+# knapsack problems?". Weights (and values) are drawn from [1, r], and the capacity of the h-th
+# instance in a series of s instances is h/(s+1) of the total weight.
+def _uncorrelated(rng, n, r):
+    return rng.integers(1, r + 1, n), rng.integers(1, r + 1, n)
+
+
+def _weakly_correlated(rng, n, r):
+    weights = rng.integers(1, r + 1, n)
+    values = weights + rng.integers(-(r // 10), r // 10 + 1, n)
+    return numpy.maximum(values, 1), weights
+
+
+def _strongly_correlated(rng, n, r):
+    weights = rng.integers(1, r + 1, n)
+    return weights + r // 10, weights
+
+
+def _inverse_strongly_correlated(rng, n, r):
+    values = rng.integers(1, r + 1, n)
+    return values, values + r // 10
+
+
+def _almost_strongly_correlated(rng, n, r):
+    weights = rng.integers(1, r + 1, n)
+    return weights + r // 10 + rng.integers(-(r // 500), r // 500 + 1, n), weights
+
+
+def _subset_sum(rng, n, r):
+    weights = rng.integers(1, r + 1, n)
+    return weights, weights
+
+
+def _uncorrelated_similar_weights(rng, n, r):
+    return rng.integers(1, 1001, n), rng.integers(100000, 100101, n)
+
+
+GENERATORS = {
+    "uncorrelated": _uncorrelated,
+    "weakly_correlated": _weakly_correlated,
+    "strongly_correlated": _strongly_correlated,
+    "inverse_strongly_correlated": _inverse_strongly_correlated,
+    "almost_strongly_correlated": _almost_strongly_correlated,
+    "subset_sum": _subset_sum,
+    "uncorrelated_similar_weights": _uncorrelated_similar_weights,
+}
+
+
+def generate_instance(n, kind="strongly_correlated", r=1000, h=50, s=100, seed=None):
+    """Generate a Pisinger-style instance as a (values, weights, capacity) tuple."""
+    rng = numpy.random.default_rng(seed)
+    values, weights = GENERATORS[kind](rng, n, r)
+    capacity = int(h * int(weights.sum()) // (s + 1))
+    return values, weights, capacity
+
+
+def verify_instance(instance_fnc, *args, **kwargs):
+    items, capacity, optimum = instance_fnc()
+    root = ArrayKnapsackTreeNode.root([
+        [i.value for i in items],
+        [i.weight for i in items],
+        capacity,
+    ])
+    sols = mcts.run(root, *args, **kwargs)
+    assert set(sols.best.data) == {i.name for i in optimum}
+    assert root.is_exhausted
+
+
+def main(n=10000, kind="strongly_correlated", time_limit=60.0, seed=0):
+    mcts.config_logging(level="INFO")
+    for instance_fnc in [knapsack.instance_1, knapsack.instance_2, knapsack.instance_8]:
+        print("_" * 100)
+        print(instance_fnc.__name__)
+        verify_instance(instance_fnc, rng_seed=seed)
+    print("_" * 100)
+    print("{} instance with {} items".format(kind, n))
+    root = ArrayKnapsackTreeNode.root(generate_instance(n, kind, seed=seed))
+    sols = mcts.run(root, time_limit=time_limit, rng_seed=seed)
+    print("best value: {}, root bound: {}".format(-sols.best.value, -root.bound()))
+
+
+usage = """usage: {prog} [n [kind [time_limit [seed]]]]
+    where
+      - n is the number of items in the generated instance
+      - kind is one of: {kinds}
+      - time_limit is the maximum CPU time allowed for the search
+      - seed initializes the pseudo-random generators""".format(
+    prog=sys.argv[0],
+    kinds=", ".join(sorted(GENERATORS)),
+)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 5:
+        print(usage)
+        exit(1)
+    converters = [int, str, float, int]
+    main(*[conv(arg) for conv, arg in zip(converters, sys.argv[1:])])
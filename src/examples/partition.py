@@ -1,6 +1,8 @@
+import sys
+import random
 from math import log
-from bisect import insort
-from collections import defaultdict
+from functools import partial
+from heapq import heapify, heappop, heappush
 
 import rr.opt.mcts.simple as mcts
 
@@ -9,42 +11,71 @@ JOIN = 0
 SPLIT = 1
 
 
-def load_instance(filepath):
+def iter_instance(filepath):
+    """Stream the numbers of an instance file (one number per line, blank lines are ignored)."""
     with open(filepath, "rt") as istream:
-        return [int(line.strip()) for line in istream]
+        for line in istream:
+            line = line.strip()
+            if line:
+                yield int(line)
+
+
+def load_instance(filepath):
+    return list(iter_instance(filepath))
+
+
+def random_instance(n, bits=48, seed=None):
+    """Generate an instance with `n` numbers drawn uniformly from [1, 2**bits)."""
+    rng = random.Random(seed)
+    return [rng.randint(1, 2**bits - 1) for _ in range(n)]
 
 
 def objective(discrepancy):
     return log(abs(discrepancy)+1, 2)
 
 
-def karmarkar_karp(labels):
+def make_labels(numbers):
+    """Build a max-heap of vertex labels, *i.e.* (-number, index) pairs, from an iterable."""
+    labels = [(-n, i) for i, n in enumerate(numbers)]
+    heapify(labels)
+    return labels
+
+
+def karmarkar_karp(labels, record_edges=True):
+    """Run the differencing heuristic on a max-heap of labels (which is left unchanged). If
+    `record_edges` is false, only the final discrepancy is computed and no edges are returned.
+    """
     labels = list(labels)
-    edges = []
-    sum_remaining = sum(n for n, _ in labels)
+    edges = [] if record_edges else None
+    sum_remaining = -sum(n for n, _ in labels)
     for _ in range(len(labels) - 1):
-        n, i = labels.pop()
-        m, j = labels.pop()
-        insort(labels, (n-m, i))
-        edges.append((i, j, SPLIT))
-        sum_remaining -= 2 * m
+        n, i = heappop(labels)
+        m, j = heappop(labels)
+        heappush(labels, (n-m, i))
+        if record_edges:
+            edges.append((i, j, SPLIT))
+        sum_remaining += 2 * m
     assert len(labels) == 1
-    assert sum_remaining == labels[0][0]
+    assert sum_remaining == -labels[0][0]
     return edges, sum_remaining
 
 
+def kk_solution_data(edges, labels):
+    """Rebuild the edges of a KK solution from the node state that originated it."""
+    return edges + karmarkar_karp(labels)[0]
+
+
 class TreeNode(mcts.TreeNode):
     EXPANSION_LIMIT = float("inf")
 
     @classmethod
     def root(cls, instance):
         if isinstance(instance, str):
-            instance = load_instance(instance)
-        assert type(instance) is list  # NPP instances are flat lists of positive integers
+            instance = iter_instance(instance)
         root = cls()
-        root.labels = sorted((n, i) for i, n in enumerate(instance))  # vertex labels (nums)
+        root.labels = make_labels(instance)  # vertex labels (nums) as a max-heap
         root.edges = []  # [(i, j, EDGE_TYPE<JOIN|SPLIT>)]
-        root.sum_remaining = sum(instance)  # sum of all numbers still unassigned
+        root.sum_remaining = -sum(n for n, _ in root.labels)  # sum of all unassigned numbers
         return root
 
     def copy(self):
@@ -62,62 +93,109 @@ class TreeNode(mcts.TreeNode):
 
     def apply(self, edge_type):
         labels = self.labels
-        n, i = labels.pop()
-        m, j = labels.pop()
+        n, i = heappop(labels)
+        m, j = heappop(labels)
         self.edges.append((i, j, edge_type))
         if edge_type == SPLIT:
-            insort(labels, (n-m, i))
-            self.sum_remaining -= 2 * m
+            heappush(labels, (n-m, i))
+            self.sum_remaining += 2 * m
         else:
-            insort(labels, (n+m, i))
+            heappush(labels, (n+m, i))
 
     def simulate(self):
         edges = self.edges
-        if len(edges) > 0 and edges[-1][-1] == SPLIT:
+        if len(edges) > 0 and edges[-1][-1] == SPLIT and self.parent is not None:
             # reuse parent solution if this is the differencing child
             return self.parent.sim_sol
         labels = self.labels
-        largest, i = labels[-1]
-        delta = largest - (self.sum_remaining - largest)
+        largest, i = labels[0]
+        delta = -largest - (self.sum_remaining + largest)
         if delta >= -1:
             # the best solution in this subtree consists of putting the largest element in one
             # set and the remaining elements in the other
-            labels.pop()
+            heappop(labels)
             for _, j in labels:
                 edges.append((i, j, SPLIT))
             del labels[:]  # force next branches() call to return empty branch list
             return mcts.Solution(value=objective(delta), data=edges)
         else:
-            kk_edges, diff = karmarkar_karp(self.labels)
-            return mcts.Solution(value=objective(diff), data=edges+kk_edges)
+            # only the discrepancy is needed, the edges are rebuilt later if necessary (note that
+            # the node's edges and labels are not modified after simulate())
+            _, diff = karmarkar_karp(labels, record_edges=False)
+            return mcts.Solution(
+                value=objective(diff),
+                make_data=partial(kk_solution_data, edges, labels),
+            )
 
 
 def make_partition(edges):
-    adj = {
-        JOIN: defaultdict(set),
-        SPLIT: defaultdict(set),
-    }
-    for i, j, edge_type in edges:
-        adj_edge_type = adj[edge_type]
-        adj_edge_type[i].add(j)
-        adj_edge_type[j].add(i)
+    """Rebuild the partition (a list of subset indices, 0 or 1) defined by a spanning tree of
+    JOIN/SPLIT edges, using a union-find structure where each vertex also keeps the parity of
+    its path to the root of its set (0 = same subset, 1 = opposite subsets).
+    """
     nverts = len(edges) + 1
-    subset = [None] * nverts
-    _assign_subset(adj, subset, 0, 0)
-    return subset
-
+    parent = list(range(nverts))
+    parity = [0] * nverts
+
+    def find(i):
+        # first pass: find the root and the parity of i relative to it
+        root = i
+        p = 0
+        while parent[root] != root:
+            p ^= parity[root]
+            root = parent[root]
+        # second pass: path compression (parities become relative to the root)
+        p_i = p
+        while parent[i] != root:
+            next_i = parent[i]
+            next_p = p ^ parity[i]
+            parent[i] = root
+            parity[i] = p
+            i = next_i
+            p = next_p
+        return root, p_i
 
-def _assign_subset(adj, subset, i, s):
-    subset[i] = s
-    for edge_type in (JOIN, SPLIT):
-        adj_edge_type = adj[edge_type]
-        adj_edge_type_i = adj_edge_type.pop(i, ())
-        s_j = s if edge_type == JOIN else 1 - s
-        for j in adj_edge_type_i:
-            adj_edge_type[j].remove(i)
-            _assign_subset(adj, subset, j, s_j)
-
-
-mcts.config_logging()
-r = TreeNode.root("instances/npp/hard1000.dat")
-s = mcts.run(r, iter_limit=1000)
+    for i, j, edge_type in edges:
+        root_i, p_i = find(i)
+        root_j, p_j = find(j)
+        assert root_i != root_j  # edges form a spanning tree
+        parent[root_j] = root_i
+        parity[root_j] = p_i ^ p_j ^ edge_type
+    _, p_0 = find(0)
+    return [find(i)[1] ^ p_0 for i in range(nverts)]
+
+
+def discrepancy(numbers, subset):
+    """Absolute difference between the sums of the two subsets in a partition."""
+    return abs(sum(n if s == 0 else -n for n, s in zip(numbers, subset)))
+
+
+def main(instance, niter, seed=None):
+    mcts.config_logging()
+    numbers = load_instance(instance) if isinstance(instance, str) else instance
+    root = TreeNode.root(numbers)
+    sols = mcts.run(root, iter_limit=niter, rng_seed=seed)
+    subset = make_partition(sols.best.data)
+    assert objective(discrepancy(numbers, subset)) == sols.best.value
+    print("best discrepancy: {}".format(discrepancy(numbers, subset)))
+    return root, sols
+
+
+usage = """usage: {prog} instance N [seed]
+    where
+      - instance is a file with one number per line, or "random:n" to generate n random numbers
+      - N is the number of iterations
+      - seed initializes the pseudo-random generators""".format(prog=sys.argv[0])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) in (3, 4):
+        instance = sys.argv[1]
+        niter = int(sys.argv[2])
+        seed = int(sys.argv[3]) if len(sys.argv) == 4 else None
+        if instance.startswith("random:"):
+            instance = random_instance(int(instance[len("random:"):]), seed=seed)
+        main(instance, niter, seed)
+    else:
+        print(usage)
+        exit(1)
@@ -0,0 +1,431 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future.builtins import object, range
+
+import array
+import collections
+import heapq
+import logging
+import mmap
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import traceback
+
+try:
+    from queue import Empty
+except ImportError:  # python 2
+    from Queue import Empty
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None
+
+from rr.opt.mcts.simple import INF, SearchStats, Solutions, TreeNode, run, run_simulation
+
+
+logger = logging.getLogger(__name__)
+info = logger.info
+
+
+def run_parallel(root, processes=None, time_limit=INF, rng_seed=None, donate_interval=1.0,
+                 split_factor=4, **run_kwargs):
+    """
+    Parallel search in which worker processes explore disjoint subtrees. The top of the tree is
+    split into a frontier of about `split_factor` open nodes per process, which are handed out to
+    the workers. Each worker runs :func:`.run` on its subtree, and if other workers are idle,
+    interrupts it to give away its most promising unexpanded nodes (removing them from its own
+    tree). Nodes are transferred as copies (see :meth:`.TreeNode.copy`), so they must be picklable
+    and their :meth:`.TreeNode.simulate` method must not depend on the parent node. The value of
+    the best solution found by any worker is shared with all of them, and used as their pruning
+    cutoff (see ``Solutions.shared_cutoff``). If a worker fails, the other workers are
+    terminated, and the error is raised again by this function.
+
+    Arguments:
+        root (TreeNode): the root of the search tree (which is not modified).
+        processes (int): number of worker processes (by default, the number of cpus).
+        time_limit (float): maximum wall time allowed.
+        rng_seed: seed of the random number generator which seeds the workers' searches.
+        donate_interval (float): minimum wall time between two interruptions of the search of a
+            worker (to give away nodes, or to prune its tree with a better shared cutoff), since
+            each call to :func:`.run` has a setup cost linear in the size of the tree.
+        split_factor (int): number of initial open nodes per worker.
+        run_kwargs: other arguments passed to :func:`.run` by the workers (*e.g.* `pruning`).
+
+    Returns:
+        `Solutions` object combining the results of all workers. Its best solution is flagged as
+        optimal if all subtrees were completely explored.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    rng = random.Random(rng_seed)
+    deadline = time.time() + time_limit
+    frontier = _split_frontier(root, processes * split_factor)
+    info("Starting parallel search with {} processes and {} subtrees".format(
+        processes, len(frontier)))
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    shared = _ParallelState(len(frontier))
+    for node in frontier:
+        tasks.put((node, rng.getrandbits(64)))
+    worker_args = (tasks, results, shared, deadline, donate_interval, run_kwargs)
+    workers = [
+        multiprocessing.Process(target=_parallel_worker, args=worker_args)
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    sols = Solutions()
+    is_complete = True
+    task_count = 0
+    stopped = 0
+    is_stopping = False
+    try:
+        while stopped < processes:
+            try:
+                result = results.get(timeout=1.0)
+            except Empty:
+                # A worker killed from outside (e.g. by the OOM killer) cannot report it.
+                dead = [worker for worker in workers if not worker.is_alive()]
+                if len(dead) > stopped:
+                    raise RuntimeError("Parallel search worker died (exit codes: {})".format(
+                        [worker.exitcode for worker in dead]))
+                continue
+            if result is None:
+                stopped += 1
+                continue
+            if isinstance(result, str):
+                raise RuntimeError("Parallel search worker failed:\n" + result)
+            sub_sols, is_exhausted = result
+            task_count += 1
+            is_complete = is_complete and is_exhausted
+            if sub_sols is not None:
+                sols.merge(sub_sols)
+            if shared.pending.value == 0 and not is_stopping:
+                is_stopping = True
+                for _ in workers:
+                    tasks.put(None)
+    finally:
+        for worker in workers:
+            if stopped < processes:
+                worker.terminate()  # after an error or interruption, the results are lost anyway
+            worker.join()
+    if is_complete:
+        info("Search complete, solution is optimal")
+        sols.best.is_opt = True
+        sols.dual_bound = sols.cutoff if sols.feas_count > 0 else INF
+    info("Finished parallel search ({} subtrees, {} simulations): {}".format(
+        task_count, sols.count, sols))
+    return sols
+
+
+class _ParallelState(object):
+    """Counters and incumbent value shared by the processes of :func:`run_parallel`."""
+    def __init__(self, task_count):
+        self.cutoff = multiprocessing.Value("d", INF)  # value of the best feasible solution
+        self.pending = multiprocessing.Value("i", task_count)  # tasks not finished yet
+        self.queued = multiprocessing.Value("i", task_count)  # tasks waiting in the queue
+        self.idle = multiprocessing.Value("i", 0)  # workers waiting for a task
+
+    def add(self, value, delta):
+        with value.get_lock():
+            value.value += delta
+
+    def publish(self, sols):
+        if sols.feas_count == 0:
+            return
+        with self.cutoff.get_lock():
+            if sols.feas_best.value < self.cutoff.value:
+                self.cutoff.value = sols.feas_best.value
+
+    @property
+    def is_starving(self):
+        return self.idle.value > self.queued.value
+
+
+def _split_frontier(root, count):
+    """Expand the top of the tree breadth-first until there are at least `count` open nodes (or
+    the tree is exhausted). Returns a list of detached nodes, without random number generators.
+    """
+    frontier = collections.deque([root.copy()])
+    leaves = []
+    while 0 < len(frontier) < count - len(leaves):
+        node = frontier.popleft()
+        branches = list(node.branches())
+        if len(branches) == 0:
+            leaves.append(node)  # simulated by the worker that receives it
+        for branch in branches:
+            child = node.copy()
+            child.apply(branch)
+            frontier.append(child)
+    frontier.extend(leaves)
+    for node in frontier:
+        node.rng = None
+    return list(frontier)
+
+
+def _parallel_worker(tasks, results, shared, deadline, donate_interval, run_kwargs):
+    try:
+        while True:
+            shared.add(shared.idle, +1)
+            task = tasks.get()
+            shared.add(shared.idle, -1)
+            if task is None:
+                results.put(None)
+                break
+            shared.add(shared.queued, -1)
+            node, seed = task
+            result = (None, False)
+            if time.time() < deadline:
+                result = _run_subtree(node, random.Random(seed), tasks, shared, deadline,
+                                      donate_interval, run_kwargs)
+            # The counter is decremented first, so that the coordinator receives at least one
+            # more message after it drops to zero.
+            shared.add(shared.pending, -1)
+            results.put(result)
+    except Exception:
+        # Exceptions are sent as text, since they (or their arguments) may not be picklable.
+        results.put(traceback.format_exc())
+
+
+def _run_subtree(root, rng, tasks, shared, deadline, donate_interval, run_kwargs):
+    """Search a subtree given to a worker of :func:`run_parallel`. The search is interrupted (at
+    most once every `donate_interval` seconds) only to give nodes away to idle workers, or to
+    prune the tree with a better cutoff found by another worker. Returns the :class:`.Solutions`
+    object of the search, and whether it is complete.
+    """
+    run_kwargs = dict(run_kwargs)
+    pruning = run_kwargs.get("pruning")
+    if pruning is None:
+        pruning = type(root).bound != TreeNode.bound
+    sols = Solutions()
+    sols.shared_cutoff = shared.cutoff.value
+    # wall time at which the search was last (re)started, cutoff of the last pruning of the whole
+    # tree, and whether the last call to run() was stopped by the callback below
+    state = {"start": time.time(), "pruned": sols.shared_cutoff, "interrupted": False}
+
+    def interrupt(root, sols, i, t):
+        now = time.time()
+        if now >= deadline:
+            state["interrupted"] = True
+            return True
+        if i % 64 != 0:
+            return False
+        # Cutoffs are exchanged on the fly (new expansions use the shared one right away), but
+        # only a restart prunes the nodes that a better shared cutoff dominates.
+        shared.publish(sols)
+        sols.shared_cutoff = shared.cutoff.value
+        if now - state["start"] < donate_interval:
+            return False
+        own_cutoff = sols.feas_best.value if sols.feas_count > 0 else INF
+        needs_pruning = pruning and sols.shared_cutoff < min(state["pruned"], own_cutoff)
+        state["interrupted"] = shared.is_starving or needs_pruning
+        return state["interrupted"]
+
+    callbacks = list(run_kwargs.pop("callbacks", ())) + [interrupt]
+    # Every call to run() below resumes the same search, so they share the statistics object
+    # and the trajectory stream (which run() would otherwise recreate and rewrite each time).
+    stats = run_kwargs.pop("stats", None)
+    if stats is None:
+        stats = SearchStats(phase_timing=False)
+    trajectory_file = run_kwargs.pop("trajectory_file", None)
+    if trajectory_file is not None:
+        sols.stream_trajectory(open(trajectory_file, "wt"))
+    root.rng = rng
+    run_simulation(root, sols, run_kwargs.get("sim_batch_size", 1), run_kwargs.get("rollouts"))
+    try:
+        while time.time() < deadline:
+            state["interrupted"] = False
+            run(root, sols=sols, rng=rng, callbacks=callbacks, stats=stats, **run_kwargs)
+            shared.publish(sols)
+            if root.is_exhausted or not state["interrupted"]:
+                break  # (the search also stops if run() stopped for another reason, e.g. a gap)
+            sols.shared_cutoff = shared.cutoff.value
+            if pruning and sols.cutoff < state["pruned"]:
+                root.prune(sols.cutoff)
+                state["pruned"] = sols.cutoff
+                if root.is_exhausted:
+                    break
+            if shared.is_starving:
+                for node in _donate_nodes(root, shared.idle.value - shared.queued.value):
+                    shared.add(shared.pending, +1)
+                    shared.add(shared.queued, +1)
+                    tasks.put((node, rng.getrandbits(64)))
+            state["start"] = time.time()
+    finally:
+        if sols.trajectory_stream is not None:
+            sols.trajectory_stream.close()
+            sols.trajectory_stream = None
+    # optimality and the dual bound refer to the subtree only
+    sols.best.is_opt = False
+    sols.dual_bound = -INF
+    return sols, root.is_exhausted
+
+
+def _donate_nodes(root, count):
+    """Remove up to `count` of the most promising unexpanded nodes from a tree (leaving at least
+    one in it), and return them as detached copies for other workers of :func:`run_parallel`.
+    """
+    candidates = [
+        node for node in root.iter_subtree()
+        if not node.expansion.is_started and node is not root
+    ]
+    count = min(count, len(candidates) - 1)
+    if count <= 0:
+        return []
+    chosen = heapq.nsmallest(count, candidates, key=lambda node: (node.sim_best.key, node.depth))
+    donated = []
+    for node in chosen:
+        clone = node.copy()
+        clone.rng = None
+        donated.append(clone)
+        node.delete()
+    return donated
+
+
+# Attachments of this process to shared arrays, as {name or path: (buffer, array view)}.
+_shared_arrays = {}
+
+
+if shared_memory is not None:
+    class _SharedMemory(shared_memory.SharedMemory):
+        """Shared memory block which can be closed while arrays still use it, in which case the
+        memory is unmapped only when the last of those arrays is released.
+        """
+        def close(self):
+            try:
+                shared_memory.SharedMemory.close(self)
+            except BufferError:
+                if getattr(self, "_fd", -1) >= 0:  # the mapping itself does not need the fd
+                    os.close(self._fd)
+                    self._fd = -1
+
+
+class SharedArray(object):
+    """Read-only array of numbers placed in shared memory, which other processes can attach to
+    without copying the data. This is meant for large instance data used by parallel searches:
+    the array is created once in the parent process, and only a small handle is pickled when the
+    object is sent to a worker, where :meth:`.TreeNode.root` can then use :meth:`view` as if it
+    were a regular array. Example:
+
+    .. code-block:: python
+
+        weights = parallel.SharedArray.create(weights, typecode="l")
+        pool.map(solve, [(weights, seed) for seed in seeds])  # workers call weights.view()
+        weights.unlink()
+
+    The data is kept in a :mod:`multiprocessing.shared_memory` block, or in a memory-mapped file
+    if `filepath` is given or shared memory is not available. The process that created the array
+    is responsible for calling :meth:`unlink` once it is no longer needed.
+    """
+    def __init__(self, typecode, length, name=None, filepath=None):
+        self.typecode = typecode
+        self.length = length
+        self.name = name  # name of the shared memory block
+        self.filepath = filepath  # path of the memory-mapped file
+        self._array = None
+        self.buffer = None
+        self._attach()
+
+    @classmethod
+    def create(cls, values, typecode=None, filepath=None):
+        """Copy `values` (a NumPy array, or a sequence of numbers of the type given by
+        `typecode`, see :mod:`array`) into a new shared array.
+        """
+        if hasattr(values, "dtype"):  # numpy array (copied directly from its buffer)
+            import numpy
+            if typecode is None:
+                typecode = values.dtype.char
+            values = numpy.ascontiguousarray(values, dtype=typecode)
+            data = memoryview(values).cast("B")
+        else:
+            data = memoryview(array.array(str(typecode), values)).cast("B")
+        size = max(len(data), 1)  # empty blocks and mappings are not allowed
+        if filepath is None and shared_memory is not None:
+            block = _SharedMemory(create=True, size=size)
+            block.buf[:len(data)] = data
+            block.close()
+            return cls(typecode, len(values), name=block.name)
+        if filepath is None:
+            fd, filepath = tempfile.mkstemp(prefix="mcts-", suffix=".bin")
+            os.close(fd)
+        with open(filepath, "wb") as ostream:
+            ostream.write(data)
+            ostream.write(b"\0" * (size - len(data)))
+        return cls(typecode, len(values), filepath=filepath)
+
+    def _attach(self):
+        # Each process attaches to the data only once. Attachments are kept in a module-level
+        # registry, so that they are not finalized by the garbage collector together with (and
+        # possibly before) the arrays that use them.
+        key = self.name if self.name is not None else self.filepath
+        attachment = _shared_arrays.get(key)
+        if attachment is not None:
+            self.buffer, self._array = attachment
+            return
+        if self.name is not None:
+            try:  # avoid unlinking the block when an attached process exits (python >= 3.13)
+                self.buffer = _SharedMemory(name=self.name, track=False)
+            except TypeError:
+                self.buffer = _SharedMemory(name=self.name)
+            buf = self.buffer.buf
+        else:
+            with open(self.filepath, "rb") as istream:
+                self.buffer = mmap.mmap(istream.fileno(), 0, access=mmap.ACCESS_READ)
+            buf = self.buffer
+        itemsize = array.array(str(self.typecode)).itemsize
+        try:
+            import numpy
+        except ImportError:
+            buf = memoryview(buf)[:self.length * itemsize]
+            if not buf.readonly:
+                buf = buf.toreadonly()
+            self._array = buf.cast(str(self.typecode))
+        else:
+            self._array = numpy.frombuffer(buf, dtype=self.typecode, count=self.length)
+            self._array.flags.writeable = False
+        _shared_arrays[key] = (self.buffer, self._array)
+
+    def view(self):
+        """Read-only view of the data, as a NumPy array if NumPy is available or a
+        :class:`memoryview` otherwise. The view remains valid until :meth:`close` is called.
+        """
+        return self._array
+
+    def __len__(self):
+        return self.length
+
+    def __getstate__(self):
+        return (self.typecode, self.length, self.name, self.filepath)
+
+    def __setstate__(self, state):
+        self.typecode, self.length, self.name, self.filepath = state
+        self._array = None
+        self.buffer = None
+        self._attach()
+
+    def close(self):
+        """Detach this process from the data. Views obtained previously must not be used anymore,
+        although the memory is only unmapped once they are released.
+        """
+        _shared_arrays.pop(self.name if self.name is not None else self.filepath, None)
+        self._array = None
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def unlink(self):
+        """Close the array and destroy the underlying data (in the process that created it)."""
+        self.close()
+        if self.name is not None:
+            block = _SharedMemory(name=self.name)
+            block.close()
+            block.unlink()
+        else:
+            os.remove(self.filepath)
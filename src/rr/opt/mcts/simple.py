@@ -2,15 +2,30 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
-from future.builtins import object, next, map
+from future.builtins import object, next, map, range
 
+import collections
+import gc
+import hashlib
+import heapq
 import itertools
+import json
 import logging
 import logging.config
+import multiprocessing
+import operator
+import os
 import random
+import sys
 import time
+import types
 from math import log, sqrt
 
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
 
 __version__ = "0.3.0"
 __author__ = "Rui Rei"
@@ -24,9 +39,17 @@ debug = logger.debug
 info = logger.info
 warn = logger.warning
 
+try:
+    cpu_time = time.process_time
+except AttributeError:  # python 2 (time.clock() measures cpu time on unix)
+    cpu_time = time.clock
+
 
 def run(root, time_limit=INF, iter_limit=INF, pruning=None,
-        rng_seed=None, rng_state=None, log_iter_interval=1000, sols=None):
+        rng_seed=None, rng_state=None, log_iter_interval=1000, sols=None, sim_batch_size=1,
+        rng=None, callbacks=(), stats=None, prune_mode="eager", prune_sweep_size=100,
+        initial_solutions=(), rollouts=None, trajectory_file=None, gc_policy=None,
+        abs_gap=None, rel_gap=None):
     """
     Monte Carlo Tree Search for **minimization** problems.
 
@@ -39,12 +62,47 @@ def run(root, time_limit=INF, iter_limit=INF, pruning=None,
         iter_limit (int): maximum number of iterations.
         pruning (bool or None): make the search use/not use pruning if true/false. If `None` is
             given (default), auto-detects pruning settings from root node.
-        rng_seed: an object to pass to `random.seed()`. Does not seed the RNG if no value is given.
-        rng_state: an RNG state tuple, as obtained from `random.getstate()`. Can be used to set a
-            particular RNG state at the start of the search.
+        rng_seed: an object to pass to the search RNG's `seed()` method. Does not seed the RNG if no
+            value is given.
+        rng_state: an RNG state tuple, as obtained from `random.Random.getstate()`. Can be used to
+            set a particular RNG state at the start of the search.
         log_iter_interval (int): interval, in number of iterations, between automatic log messages.
         sols (Solutions): a Solutions object obtained from a previous run of MCTS. If this argument
             is provided, a previous search can be resumed from the point where it stopped.
+        sim_batch_size (int): number of simulations run for each new node. If greater than 1,
+            the nodes' :meth:`TreeNode.simulate_batch` method is used instead of
+            :meth:`TreeNode.simulate`.
+        rng (random.Random): random number generator owned by this search, which is made
+            available to all nodes in the tree as ``node.rng``. By default, the RNG of a previous
+            search on the same tree is reused, or a new one is created (see also
+            :func:`spawn_rngs`).
+        callbacks (sequence): callables which are invoked as ``callback(root, sols, i, t)`` at
+            the end of every iteration. The search stops as soon as a callback returns true.
+        stats (SearchStats): object which is kept up to date with statistics of the search while
+            it runs, *e.g.* to publish them through a :class:`.MetricsServer`.
+        prune_mode (str): if ``"eager"`` (default), the whole tree is pruned whenever the best
+            solution improves. If ``"lazy"``, dominated nodes are only deleted when selection
+            meets them, and a background sweep visits `prune_sweep_size` nodes per iteration to
+            reclaim memory gradually (see :class:`LazyPruner`).
+        prune_sweep_size (int): number of nodes visited per iteration by the lazy pruning sweep.
+        initial_solutions (iterable): solutions known in advance (*e.g.* from a fast heuristic or
+            a previous run), which are recorded before the search starts. Their values are used
+            from the start as pruning cutoff, so dominated parts of the tree are never built.
+        rollouts (AdaptiveRollouts): policy deciding how many simulations each new node gets,
+            based on its first results. If given, `sim_batch_size` is ignored.
+        trajectory_file (str): path of a file where each new incumbent is written (as a line of
+            JSON, see :meth:`Incumbent.json`) as soon as it is found.
+        gc_policy (str or None): how Python's cyclic garbage collector is handled during the
+            search (deleted nodes are freed without it). ``"freeze"`` periodically moves the
+            nodes of the growing tree out of the collector's reach (see :func:`gc.freeze`),
+            ``"tune"`` raises the collection thresholds to `GC_TUNED_THRESHOLDS`, and
+            ``"disable"`` disables the collector. The previous settings are restored when the
+            search ends. Pauses are measured in `stats` in all cases.
+        abs_gap (float): if given, the search stops as soon as the absolute optimality gap
+            (see :attr:`Solutions.abs_gap`) is not greater than this value. The global dual bound
+            is only tracked (in ``sols.dual_bound``) if pruning is enabled.
+        rel_gap (float): if given, the search stops as soon as the relative optimality gap (see
+            :attr:`Solutions.rel_gap`) is not greater than this value, *e.g.* 0.01 for 1%.
 
     Returns:
         `Solutions` object containing the best solution found by the search, as well as the list
@@ -54,63 +112,950 @@ def run(root, time_limit=INF, iter_limit=INF, pruning=None,
         # Guess pruning by comparing the bound() method from the root node's class with the
         # bound() method from the base TreeNode class.
         pruning = type(root).bound != TreeNode.bound
+    if rng is None:
+        rng = root.rng if isinstance(root.rng, random.Random) else random.Random()
     if rng_seed is not None:
         info("Seeding RNG with {}...".format(rng_seed))
-        random.seed(rng_seed)
+        rng.seed(rng_seed)
     if rng_state is not None:
         rng_state_repr = "\n\t".join(map(str, rng_state))
         info("Setting RNG state to...\n\t{}".format(rng_state_repr))
-        random.setstate(rng_state)
+        rng.setstate(rng_state)
+    if root.rng is not rng:
+        for node in root.iter_subtree():
+            node.rng = rng
     info("Pruning is {}.".format("enabled" if pruning else "disabled"))
 
-    t0 = time.clock()  # initial cpu time
-    if sols is None:
-        info("Starting new search")
+    if stats is None:
+        stats = SearchStats(phase_timing=False)
+    phase_times = stats.phase_times
+    phase_timing = stats.phase_timing  # the clock is only read between phases if true
+
+    is_new_search = sols is None
+    if is_new_search:
         sols = Solutions()  # object used to keep track of our best/worst solutions
-        sol = root.simulate()  # run simulation from root and
-        root.backpropagate(sol)  # backpropagate the solution
-        sols.update(sol)
-    else:
-        info("Resuming previous search")
-    t = time.clock() - t0  # cpu time elapsed
+    gc_state = set_gc_policy(gc_policy)
+    stats.start()
+    t0 = cpu_time()  # cpu time at the start of this call (time_limit applies to each call)
+    t = 0.0  # cpu time elapsed
     i = 0  # iteration count
-
     try:
+        sols.stats = stats  # used to timestamp new incumbents
+        stats.tree_size = stats.tree_size_peak = root.tree_size()
+        if trajectory_file is not None:
+            sols.stream_trajectory(open(trajectory_file, "wt"))
+        if not is_new_search:
+            info("Resuming previous search")
+        elif root.sim_count == 0:
+            info("Starting new search")
+            run_simulation(root, sols, sim_batch_size, rollouts)  # simulate root and backpropagate
+        else:
+            # The tree was kept from a previous search (see TreeNode.make_root()), so we collect the
+            # simulation results already in it.
+            info("Starting new search on existing tree")
+            for node in root.iter_subtree():
+                sols.update(node.sim_sol)
+        stats.sols = sols
+        initial_solutions = list(initial_solutions)  # may be given as a generator
+        if len(initial_solutions) > 0:
+            z0 = sols.best.key
+            for sol in initial_solutions:
+                sols.update(sol)
+            info("Warm start with {} initial solutions: {}".format(len(initial_solutions), sols))
+            if pruning and sols.best.is_feas and sols.best.key < z0:
+                removed = root.prune(sols.cutoff)
+                info("Pruning removed {} nodes".format(removed))
+                stats.tree_size -= removed
+                stats.pruned_nodes += removed
+        pruner = None
+        if pruning and prune_mode == "lazy":
+            pruner = LazyPruner(root, sols.cutoff, prune_sweep_size)
+        elif prune_mode not in ("eager", "lazy"):
+            raise ValueError("unknown prune mode: {!r}".format(prune_mode))
+        dual = None
+        if pruning:
+            dual = DualBound(root)
+            sols.dual_bound = max(sols.dual_bound, dual.value(sols.cutoff))
+        t = cpu_time() - t0
+        frozen_size = stats.tree_size  # tree size at the last gc.freeze() (for the "freeze" policy)
+
         while i < iter_limit and t < time_limit:
             logger.log(
                 level=logging.INFO if i % log_iter_interval == 0 else logging.DEBUG,
-                msg="[i={:<5} t={:3.02f}] {}".format(i, t, sols),
+                msg="[i={:<5} t={:3.02f}] {}{}".format(
+                    i, t, "" if dual is None else "bound={} gap={:.2%} ".format(
+                        sols.dual_bound, sols.rel_gap), sols),
             )
-            node = root.select(sols)  # selection step
+            if phase_timing:
+                t_select = cpu_time()
+            node = root.select(sols, pruner)  # selection step
+            if phase_timing:
+                t_expand = cpu_time()
+                phase_times["select"] += t_expand - t_select
+            if pruner is not None:
+                pruner.sweep()
+                stats.tree_size -= pruner.removed
+                stats.pruned_nodes += pruner.removed
+                pruner.removed = 0
+                if phase_timing:
+                    t_swept = cpu_time()
+                    phase_times["prune"] += t_swept - t_expand
+                    t_expand = t_swept  # (the sweep is not part of the expansion)
             if node is None:
                 info("Search complete, solution is optimal")
                 sols.best.is_opt = True
+                if dual is not None:
+                    sols.dual_bound = max(sols.dual_bound, dual.value(sols.cutoff))
                 break  # tree exhausted
-            new_children = node.expand(pruning=pruning, cutoff=sols.best.value)  # expansion step
+            new_children = node.expand(pruning=pruning, cutoff=sols.cutoff)  # expansion step
+            if phase_timing:
+                t_simulate = cpu_time()
+                phase_times["expand"] += t_simulate - t_expand
+            stats.tree_size += len(new_children)
             if len(new_children) == 0 and node.is_exhausted:
-                node.delete()
+                stats.tree_size -= node.delete()
+                if phase_timing:
+                    phase_times["prune"] += cpu_time() - t_simulate
             else:
-                z0 = sols.best.value
-                for child in new_children:
-                    sol = child.simulate()  # simulation step
-                    child.backpropagate(sol)  # backpropagation step
-                    sols.update(sol)
-                    assert child.sim_count > 0
-                # prune only once after all child solutions have been accounted for
-                if pruning and sols.best.value < z0:
-                    ts0 = root.tree_size()
-                    root.prune(sols.best.value)
-                    ts1 = root.tree_size()
-                    info("Pruning removed {} nodes ({} => {})".format(ts0 - ts1, ts0, ts1))
+                z0 = sols.best.key
+                results = [
+                    run_simulation(child, sols, sim_batch_size, rollouts, backpropagate=False)
+                    for child in new_children
+                ]
+                node.backpropagate_children(new_children, results)  # ancestors are updated once
+                if phase_timing:
+                    t_prune = cpu_time()
+                    phase_times["simulate"] += t_prune - t_simulate
+                # prune only once after all child solutions have been accounted for (and only if
+                # the new best solution is feasible, since bounds cannot prune anything otherwise)
+                improved = pruning and sols.best.is_feas and sols.best.key < z0
+                if improved and pruner is not None:
+                    pruner.set_cutoff(sols.cutoff)
+                    stats.prune_count += 1
+                elif improved:
+                    removed = root.prune(sols.cutoff)
+                    info("Pruning removed {} nodes ({} => {})".format(
+                        removed, stats.tree_size, stats.tree_size - removed))
+                    stats.tree_size -= removed
+                    stats.prune_count += 1
+                    stats.pruned_nodes += removed
+                    if phase_timing:
+                        phase_times["prune"] += cpu_time() - t_prune
+            stats.tree_size_peak = max(stats.tree_size_peak, stats.tree_size)
+            if dual is not None:
+                dual.add_all(new_children)
+                sols.dual_bound = max(sols.dual_bound, dual.value(sols.cutoff))
+                if ((abs_gap is not None and sols.abs_gap <= abs_gap) or
+                        (rel_gap is not None and sols.rel_gap <= rel_gap)):
+                    info("Gap limit reached (bound={}, gap={:.2%})".format(
+                        sols.dual_bound, sols.rel_gap))
+                    if sols.abs_gap == 0.0:
+                        sols.best.is_opt = True
+                    break
+            if gc_policy == "freeze" and stats.tree_size >= 2 * frozen_size:
+                gc.freeze()  # the tree doubled since the last freeze
+                frozen_size = stats.tree_size
             # update elapsed time and iteration counter
-            t = time.clock() - t0
+            now = cpu_time()
+            t = now - t0
             i += 1
+            stats.iterations += 1
+            stats.cpu_time = now - stats.cpu_start
+            if any(callback(root, sols, i, t) for callback in callbacks):
+                info("Search stopped by callback")
+                break
     except KeyboardInterrupt:
         info("Keyboard interrupt!")
+    finally:
+        stats.stop()
+        if trajectory_file is not None and sols.trajectory_stream is not None:
+            sols.trajectory_stream.close()
+            sols.trajectory_stream = None
+        restore_gc_policy(gc_policy, gc_state)
     info("Finished at iter {} ({:.02f}s): {}".format(i, t, sols))
     return sols
 
 
+GC_TUNED_THRESHOLDS = (50000, 50, 100)  # garbage collection thresholds for gc_policy="tune"
+
+
+def set_gc_policy(policy):
+    """Apply a garbage collection policy of :func:`run`. Returns the previous gc settings."""
+    state = (gc.isenabled(), gc.get_threshold())
+    if policy == "freeze":
+        gc.collect()
+        gc.freeze()
+    elif policy == "tune":
+        gc.set_threshold(*GC_TUNED_THRESHOLDS)
+    elif policy == "disable":
+        gc.disable()
+    elif policy is not None:
+        raise ValueError("unknown gc policy: {!r}".format(policy))
+    return state
+
+
+def restore_gc_policy(policy, state):
+    """Undo :func:`set_gc_policy`, given the settings that it returned."""
+    is_enabled, thresholds = state
+    if policy == "freeze":
+        gc.unfreeze()
+    gc.set_threshold(*thresholds)
+    if is_enabled:
+        gc.enable()
+
+
+def run_simulation(node, sols, batch_size=1, rollouts=None, backpropagate=True):
+    """Run the simulation step on a newly created node, backpropagate the result and record it in
+    the argument :class:`Solutions` object. A single :meth:`TreeNode.simulate` call is made if
+    `batch_size` is 1, otherwise the node's :meth:`TreeNode.simulate_batch` method is used. If a
+    `rollouts` policy is given, it decides how many simulations are made instead.
+
+    Returns the best solution and the number of simulations, which are left for the caller to
+    backpropagate (see :meth:`TreeNode.backpropagate_children`) if `backpropagate` is false.
+    """
+    if rollouts is not None:
+        results = rollouts.simulate(node, sols)
+        best = results[0]
+        for sol in results:
+            if sol.key < best.key:
+                best = sol
+        count = len(results)
+        for sol in results:
+            sols.update(sol)
+    elif batch_size == 1:
+        best = node.simulate()
+        count = 1
+        sols.update(best)
+    else:
+        batch = node.simulate_batch(batch_size)
+        best = batch.best
+        count = batch.count
+        sols.merge(batch)
+    if backpropagate:
+        node.backpropagate(best, count=count)
+    return best, count
+
+
+def run_beam(root, width, time_limit=INF, pruning=None, rng_seed=None, rng=None, sols=None,
+             processes=1, log_layer_interval=100):
+    """
+    Beam search for **minimization** problems, over the same :class:`TreeNode` subclasses as
+    :func:`run`.
+
+    The search proceeds one layer (depth) at a time: all children of the nodes in the current
+    layer are created, each child is scored by a single call to :meth:`TreeNode.simulate` (whose
+    results are recorded as in :func:`run`), and the `width` children with the best scores form
+    the next layer. Nodes are not linked into a tree, and at most two layers are kept in memory.
+
+    Arguments:
+        root (TreeNode): the root node.
+        width (int): maximum number of nodes in each layer.
+        time_limit (float): maximum CPU time allowed (checked between layers).
+        pruning (bool or None): discard children whose bound (see :meth:`TreeNode.bound` and
+            :meth:`TreeNode.branch_bound`) is not better than the best solution found. If `None`
+            is given (default), auto-detects pruning settings from root node.
+        rng_seed: an object to pass to the search RNG's `seed()` method.
+        rng (random.Random): random number generator of the search. Each child is simulated
+            with its own RNG, seeded from this one, so the results do not depend on `processes`.
+        sols (Solutions): object where results are recorded (*e.g.* from a previous search).
+        processes (int): number of worker processes used to simulate the children of each
+            layer. If greater than 1, nodes and solutions must be picklable.
+        log_layer_interval (int): interval, in number of layers, between automatic log messages.
+
+    Returns:
+        `Solutions` object containing the best solution found by the search. The best solution is
+        only flagged as optimal if no layer was ever truncated to `width` nodes.
+    """
+    if pruning is None:
+        pruning = type(root).bound != TreeNode.bound
+    if rng is None:
+        rng = root.rng if isinstance(root.rng, random.Random) else random.Random()
+    if rng_seed is not None:
+        info("Seeding RNG with {}...".format(rng_seed))
+        rng.seed(rng_seed)
+    root.rng = rng
+    if sols is None:
+        sols = Solutions()
+    info("Starting beam search (width={}, pruning {})".format(
+        width, "enabled" if pruning else "disabled"))
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    t0 = cpu_time()
+    t = 0.0
+    depth = 0
+    is_truncated = False
+    try:
+        layer = [root]
+        sol = _simulate_candidate((root, rng.getrandbits(64)))
+        root.rng = rng
+        if root.sim_sol is None:
+            root.sim_sol = sol
+        sols.update(sol)
+        while len(layer) > 0 and t < time_limit:
+            logger.log(
+                level=logging.INFO if depth % log_layer_interval == 0 else logging.DEBUG,
+                msg="[d={:<5} t={:3.02f}] width={} {}".format(depth, t, len(layer), sols),
+            )
+            # create all (non-dominated) children of the current layer
+            candidates = []
+            cutoff = sols.cutoff
+            for node in layer:
+                for branch in node.branches():
+                    if pruning and node.branch_bound(branch) >= cutoff:
+                        continue
+                    child = node.copy()
+                    child.apply(branch)
+                    if pruning:
+                        child.bound_value = child.bound()
+                        if child.bound_value >= cutoff:
+                            child.release()
+                            continue
+                    child.parent = node  # only for simulate(), the child is not added to the tree
+                    candidates.append(child)
+            # simulate all children, each with its own seed
+            jobs = [(child, rng.getrandbits(64)) for child in candidates]
+            if pool is None:
+                results = list(map(_simulate_candidate, jobs))
+            else:
+                chunk_size = max(1, len(jobs) // (4 * processes))
+                results = pool.map(_simulate_candidate, jobs, chunk_size)
+            for child, sol in zip(candidates, results):
+                child.rng = rng
+                child.sim_sol = sol
+                sols.update(sol)
+            for node in layer:
+                if node is not root:
+                    node.release()
+            # keep the best children which are still not dominated by the best solution
+            if pruning:
+                cutoff = sols.cutoff
+                survivors = [child for child in candidates if not child.bound_value >= cutoff]
+            else:
+                survivors = candidates
+            if len(survivors) > width:
+                is_truncated = True
+                survivors = heapq.nsmallest(width, survivors, key=lambda n: n.sim_sol.key)
+            kept = set(map(id, survivors))
+            for child in candidates:
+                child.parent = None
+                if id(child) not in kept:
+                    child.release()
+            layer = survivors
+            depth += 1
+            t = cpu_time() - t0
+        if len(layer) == 0 and not is_truncated:
+            info("Search complete, solution is optimal")
+            sols.best.is_opt = True
+    except KeyboardInterrupt:
+        info("Keyboard interrupt!")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    info("Finished beam search at depth {} ({:.02f}s): {}".format(depth, t, sols))
+    return sols
+
+
+def _simulate_candidate(job):
+    node, seed = job
+    node.rng = random.Random(seed)
+    return node.simulate()
+
+
+def run_bnb(root, time_limit=INF, iter_limit=INF, rng_seed=None, rng=None, sols=None,
+            simulate=True, log_iter_interval=1000, callbacks=()):
+    """
+    Best-first branch-and-bound for **minimization** problems, over the same :class:`TreeNode`
+    subclasses as :func:`run` (which must define :meth:`TreeNode.bound`).
+
+    Open nodes are kept in a priority queue ordered by bound, and are not linked to each other,
+    so only the frontier of the search is kept in memory. In each iteration, the open node with
+    the lowest bound is expanded, and its children whose bound is better than the best solution
+    found are added to the queue. The search proves the optimality of the best solution as soon
+    as the lowest bound in the queue is not better than it. Solutions are obtained by simulating
+    the root, every new node (if `simulate` is true) and every leaf node.
+
+    If `root` is the root of a tree built by :func:`run` (*e.g.* a search stopped early by
+    :class:`StagnationStop`, see also :func:`run_hybrid`), branch-and-bound starts from the open
+    nodes of that tree: the nodes which were not expanded yet, and the children not yet created
+    by partially expanded nodes. The rest of the tree is released.
+
+    Arguments:
+        root (TreeNode): the root node, or the root of a tree built by :func:`run`.
+        time_limit (float): maximum CPU time allowed.
+        iter_limit (int): maximum number of iterations (node expansions).
+        rng_seed (int): seed for the search's random number generator.
+        rng (random.Random): random number generator used by the simulations (see :func:`run`).
+        sols (Solutions): object where results are recorded (*e.g.* obtained from :func:`run`).
+            Its best solution is used for pruning from the start.
+        simulate (bool): whether new nodes are simulated, as a primal heuristic.
+        log_iter_interval (int): interval, in number of iterations, between automatic log messages.
+        callbacks (sequence): callables which are invoked as ``callback(root, sols, i, t)`` at
+            the end of every iteration. The search stops as soon as a callback returns true.
+
+    Returns:
+        `Solutions` object containing the best solution found by the search.
+    """
+    t0 = cpu_time()
+    if rng is None:
+        rng = root.rng if isinstance(root.rng, random.Random) else random.Random()
+    if rng_seed is not None:
+        info("Seeding RNG with {}...".format(rng_seed))
+        rng.seed(rng_seed)
+    root.rng = rng
+    if sols is None:
+        sols = Solutions()
+    queue = []  # heap of (bound, -counter, node), ties are broken in favor of the newest node
+    counter = itertools.count()
+    info("Starting branch-and-bound")
+    for node in _open_nodes(root, sols, simulate):
+        node.rng = rng
+        bound = node.bound_value if node.bound_value is not None else node.bound()
+        if not bound >= sols.cutoff:
+            queue.append((bound, -next(counter), node))
+    heapq.heapify(queue)
+    info("Branch-and-bound starts with {} open nodes".format(len(queue)))
+    t = cpu_time() - t0
+    i = 0
+    is_finished = False
+    try:
+        while i < iter_limit and t < time_limit:
+            if len(queue) == 0 or queue[0][0] >= sols.cutoff:
+                is_finished = True
+                break
+            sols.dual_bound = max(sols.dual_bound, queue[0][0])
+            logger.log(
+                level=logging.INFO if i % log_iter_interval == 0 else logging.DEBUG,
+                msg="[i={:<5} t={:3.02f}] open={} bound={} {}".format(
+                    i, t, len(queue), queue[0][0], sols),
+            )
+            _, _, node = heapq.heappop(queue)
+            cutoff = sols.cutoff
+            is_leaf = True
+            for branch in node.branches():
+                is_leaf = False
+                if node.branch_bound(branch) >= cutoff:
+                    continue
+                child = node.copy()
+                child.apply(branch)
+                child.bound_value = child.bound()
+                if child.bound_value >= cutoff:
+                    child.release()
+                    continue
+                if simulate:
+                    _simulate_open_node(child, node, sols)
+                heapq.heappush(queue, (child.bound_value, -next(counter), child))
+            if is_leaf and node.sim_sol is None:
+                _simulate_open_node(node, None, sols)
+            if node is not root:
+                node.release()
+            t = cpu_time() - t0
+            i += 1
+            if any(callback(root, sols, i, t) for callback in callbacks):
+                info("Search stopped by callback")
+                break
+    except KeyboardInterrupt:
+        info("Keyboard interrupt!")
+    if len(queue) == 0 or queue[0][0] >= sols.cutoff:
+        is_finished = True  # (also when the loop stopped, or never ran, before checking it)
+    if is_finished:
+        info("Search complete, solution is optimal")
+        sols.best.is_opt = True
+        sols.dual_bound = max(sols.dual_bound, sols.cutoff if sols.feas_count > 0 else INF)
+    else:
+        info("Lowest bound of {} open nodes: {}".format(len(queue), queue[0][0]))
+    info("Finished branch-and-bound at iter {} ({:.02f}s): {}".format(i, t, sols))
+    return sols
+
+
+def _simulate_open_node(node, parent, sols):
+    node.parent = parent  # only for simulate(), the node is not linked to the parent
+    node.sim_sol = node.simulate()
+    node.parent = None
+    sols.update(node.sim_sol)
+
+
+def _open_nodes(root, sols, simulate):
+    """Collect the open nodes of a tree built by :func:`run` (used by :func:`run_bnb`), *i.e.*
+    the nodes not yet expanded and the missing children of partially expanded nodes, as detached
+    nodes. All other nodes except the root are released.
+    """
+    if not root.expansion.is_started:
+        if root.sim_sol is None:
+            _simulate_open_node(root, None, sols)
+        return [root]
+    open_nodes = []
+    closed_nodes = []
+    for node in root.iter_subtree():
+        expansion = node.expansion
+        if not expansion.is_started:
+            open_nodes.append(node)
+            continue
+        while not expansion.is_finished:
+            child = expansion.next()
+            if simulate:
+                _simulate_open_node(child, node, sols)
+            open_nodes.append(child)
+        closed_nodes.append(node)
+    for node in open_nodes:
+        node.path = ()
+        node.parent = None
+    for node in closed_nodes:
+        if node is not root:
+            node.release()
+    return open_nodes
+
+
+class StagnationStop(object):
+    """Callback for :func:`run` (or :func:`run_bnb`) which stops the search when the best solution
+    has not improved in the last `iterations` iterations or `time` seconds of cpu time.
+    """
+    def __init__(self, iterations=INF, time=INF):
+        self.iterations = iterations
+        self.time = time
+        self.count = 0  # number of improving solutions at the last improvement
+        self.last_iteration = 0
+        self.last_time = 0.0
+
+    def __call__(self, root, sols, i, t):
+        if len(sols.list) != self.count:
+            self.count = len(sols.list)
+            self.last_iteration = i
+            self.last_time = t
+            return False
+        return i - self.last_iteration >= self.iterations or t - self.last_time >= self.time
+
+
+def run_hybrid(root, stagnation_iters=INF, stagnation_time=INF, time_limit=INF, **run_kwargs):
+    """Run MCTS (see :func:`run`) until the best solution stagnates, and then switch to
+    best-first branch-and-bound (see :func:`run_bnb`) to prove its optimality. Branch-and-bound
+    continues from the incumbent and the open nodes of the MCTS tree. Returns the
+    :class:`Solutions` object of the whole search.
+    """
+    t0 = cpu_time()
+    stagnation = StagnationStop(stagnation_iters, stagnation_time)
+    callbacks = list(run_kwargs.pop("callbacks", ())) + [stagnation]
+    sols = run(root, time_limit=time_limit, callbacks=callbacks, **run_kwargs)
+    if sols.best.is_opt:
+        return sols
+    info("Switching to branch-and-bound")
+    return run_bnb(root, time_limit=time_limit - (cpu_time() - t0), sols=sols)
+
+
+class AdaptiveRollouts(object):
+    """Rollout policy which gives several simulations to new nodes whose first result looks
+    promising, and a single one to all others. Example:
+
+    .. code-block:: python
+
+        sols = mcts.run(root, rollouts=mcts.AdaptiveRollouts(max_rollouts=8))
+
+    A node is promising if its best result is within `reach` standard deviations of the best
+    solution found so far, and closer nodes are allowed more simulations, up to `max_rollouts`.
+    The budget of a node is revised after each of its simulations. After the first one, the
+    spread of the node's results can only be predicted from other nodes, so a pooled estimate of
+    the spread within all nodes simulated more than once is used (the first `warmup` nodes are
+    always simulated twice for this purpose). From the second one on, the node's own mean and
+    variance are tracked (with Welford's method), and its spread is estimated from its own
+    results, with the pooled estimate as a prior worth one degree of freedom. Simulations of a
+    node stop early when `patience` consecutive simulations fail to improve its best result, and
+    the extra simulations of all nodes are limited to a fraction `time_share` of the CPU time of
+    the search. If simulations turn out to be deterministic, no extra simulations are made after
+    the warmup.
+    """
+    def __init__(self, max_rollouts=8, patience=2, reach=2.0, time_share=0.25, warmup=20):
+        self.max_rollouts = max_rollouts
+        self.patience = patience
+        self.reach = reach
+        self.time_share = time_share
+        self.warmup = warmup
+        self.node_count = 0  # number of nodes simulated
+        self.sim_count = 0  # total number of simulations
+        self.extra_count = 0  # simulations beyond the first of each node
+        self.sim_time = 0.0  # total cpu time of simulations
+        self.extra_time = 0.0  # cpu time of extra simulations
+        self.sq_dev_sum = 0.0  # pooled sum of squared deviations from each node's mean result
+        self.dof = 0  # degrees of freedom of the pooled sum
+        self.start_time = None
+
+    @property
+    def sigma(self):
+        """Pooled estimate of the standard deviation of simulation results within a node."""
+        return sqrt(self.sq_dev_sum / self.dof) if self.dof > 0 else None
+
+    def node_sigma(self, count, sq_dev_sum):
+        """Estimate the standard deviation of the simulation results of a node, given the number
+        of its (feasible) results and the sum of their squared deviations from their mean.
+        """
+        if count < 2:
+            return self.sigma
+        if self.dof == 0:
+            return sqrt(sq_dev_sum / (count - 1))
+        return sqrt((sq_dev_sum + self.sq_dev_sum / self.dof) / count)
+
+    @property
+    def sim_cost(self):
+        """Average cpu time of a simulation."""
+        return self.sim_time / self.sim_count if self.sim_count > 0 else 0.0
+
+    def budget(self, sol, sols, sigma=None):
+        """Maximum number of simulations for a node whose best simulation so far produced `sol`,
+        given the standard deviation `sigma` of its results (the pooled estimate if omitted).
+        """
+        if self.node_count <= self.warmup:
+            budget = 2
+        elif sol.is_infeas:
+            budget = 1 if sols.best.is_feas else self.max_rollouts
+        elif sols.best.is_infeas:
+            budget = self.max_rollouts
+        else:
+            if sigma is None:
+                sigma = self.sigma
+            if not sigma:
+                return 1  # deterministic simulations (or no evidence otherwise)
+            z = max(sol.value - sols.best.value, 0.0) / sigma
+            if z > self.reach:
+                return 1
+            budget = 1 + int(round((self.max_rollouts - 1) * (1.0 - z / self.reach)))
+        # extra simulations must fit in their share of the cpu time used so far
+        sim_cost = self.sim_cost
+        if budget > 1 and sim_cost > 0.0:
+            allowance = self.time_share * (cpu_time() - self.start_time) - self.extra_time
+            budget = min(budget, 1 + max(int(allowance / sim_cost), 0))
+        return budget
+
+    def simulate(self, node, sols):
+        """Run the simulations of a new node. Returns the list of solutions obtained."""
+        if self.start_time is None:
+            self.start_time = cpu_time()
+        results = []
+        best = None
+        budget = 1
+        failures = 0
+        count = 0  # Welford's running count, mean and sum of squared deviations of the node's
+        mean = 0.0  # feasible results
+        sq_dev_sum = 0.0
+        while len(results) < budget and failures < self.patience:
+            t0 = cpu_time()
+            sol = node.simulate()
+            elapsed = cpu_time() - t0
+            self.sim_time += elapsed
+            if len(results) > 0:
+                self.extra_time += elapsed
+            results.append(sol)
+            if sol.is_feas:
+                count += 1
+                delta = sol.value - mean
+                mean += delta / count
+                sq_dev_sum += delta * (sol.value - mean)
+            if best is None or sol.key < best.key:
+                best = sol
+                failures = 0
+            else:
+                failures += 1
+            budget = self.budget(best, sols, self.node_sigma(count, sq_dev_sum))
+        self.node_count += 1
+        self.sim_count += len(results)
+        self.extra_count += len(results) - 1
+        if count > 1:
+            self.sq_dev_sum += sq_dev_sum
+            self.dof += count - 1
+        return results
+
+
+class SearchStats(object):
+    """Live statistics of a search. An object of this class can be passed to :func:`run`, which
+    keeps its attributes up to date as the search progresses (with negligible overhead), so they
+    can be read at any time, *e.g.* from another thread by a :class:`.MetricsServer` or
+    :class:`.MetricsFile`.
+
+    If `phase_timing` is true, the cpu time spent in each phase of the algorithm is measured and
+    accumulated in ``phase_times``.
+    """
+    PHASES = ("select", "expand", "simulate", "prune")
+
+    def __init__(self, phase_timing=True):
+        self.phase_timing = phase_timing
+        self.sols = None  # Solutions object of the search
+        self.is_running = False  # true while run() is executing
+        self.iterations = 0  # number of iterations executed
+        self.cpu_time = 0.0  # cpu time elapsed in the search (over all run() calls)
+        self.cpu_start = None  # cpu time at which the search started, discounting pauses
+        self.wall_start = None  # wall clock time at the start of the search
+        self.wall_time = 0.0  # wall time elapsed in the search (updated when it stops)
+        self.tree_size = 0  # current number of nodes in the tree
+        self.tree_size_peak = 0  # maximum number of nodes in the tree
+        self.prune_count = 0  # number of times that the tree was pruned
+        self.pruned_nodes = 0  # number of nodes removed by pruning
+        self.phase_times = dict.fromkeys(self.PHASES, 0.0)  # cpu time spent in each phase
+        self.gc_collections = 0  # number of garbage collections during the search
+        self.gc_pause_time = 0.0  # total wall time of garbage collection pauses
+        self.gc_pause_max = 0.0  # longest garbage collection pause
+        self._gc_pause_start = None
+
+    def start(self):
+        self.is_running = True
+        # A resumed search continues the same clock, so that times and rates cover all calls.
+        self.cpu_start = cpu_time() - self.cpu_time
+        if self.wall_start is None:
+            self.wall_start = time.time()
+        if hasattr(gc, "callbacks"):  # python >= 3.3
+            gc.callbacks.append(self.gc_callback)
+
+    def stop(self):
+        self.is_running = False
+        self.wall_time = time.time() - self.wall_start
+        if hasattr(gc, "callbacks"):
+            gc.callbacks.remove(self.gc_callback)
+
+    def gc_callback(self, phase, gc_info):
+        """Measure the pauses of the garbage collector (registered in :data:`gc.callbacks`)."""
+        if phase == "start":
+            self._gc_pause_start = time.time()
+        elif self._gc_pause_start is not None:
+            pause = time.time() - self._gc_pause_start
+            self._gc_pause_start = None
+            self.gc_collections += 1
+            self.gc_pause_time += pause
+            self.gc_pause_max = max(self.gc_pause_max, pause)
+
+    def metrics(self):
+        """Produce a list of (name, type, description, value) tuples describing the current
+        state of the search, with names and types following Prometheus' conventions.
+        """
+        wall_time = 0.0 if self.wall_start is None else time.time() - self.wall_start
+        metrics = [
+            ("mcts_running", "gauge", "Whether the search is running", int(self.is_running)),
+            ("mcts_iterations_total", "counter", "Iterations executed", self.iterations),
+            ("mcts_iterations_per_second", "gauge", "Average iterations per second of cpu time",
+             self.iterations / self.cpu_time if self.cpu_time > 0.0 else 0.0),
+            ("mcts_cpu_seconds_total", "counter", "Cpu time elapsed in the search", self.cpu_time),
+            ("mcts_wall_seconds_total", "counter", "Wall time elapsed in the search", wall_time),
+            ("mcts_tree_size", "gauge", "Nodes in the search tree", self.tree_size),
+            ("mcts_tree_size_peak", "gauge", "Maximum nodes in the search tree",
+             self.tree_size_peak),
+            ("mcts_prunes_total", "counter", "Times that the tree was pruned", self.prune_count),
+            ("mcts_pruned_nodes_total", "counter", "Nodes removed by pruning", self.pruned_nodes),
+            ("mcts_gc_collections_total", "counter", "Garbage collections", self.gc_collections),
+            ("mcts_gc_pause_seconds_total", "counter", "Wall time of garbage collection pauses",
+             self.gc_pause_time),
+            ("mcts_gc_pause_max_seconds", "gauge", "Longest garbage collection pause",
+             self.gc_pause_max),
+        ]
+        if self.phase_timing:
+            for phase in self.PHASES:
+                metrics.append((
+                    "mcts_phase_{}_seconds_total".format(phase), "counter",
+                    "Cpu time spent in the {} phase".format(phase), self.phase_times[phase],
+                ))
+        rss = resident_set_size()
+        if rss is not None:
+            metrics.append(("mcts_resident_memory_bytes", "gauge", "Resident set size", rss))
+        sols = self.sols
+        if sols is not None:
+            best = sols.best
+            count = sols.feas_count + sols.infeas_count
+            metrics.extend([
+                ("mcts_incumbent_value", "gauge", "Value of the best feasible solution",
+                 best.value if best.is_feas else float("nan")),
+                ("mcts_incumbent_infeasibility", "gauge", "Infeasibility of the best solution",
+                 0.0 if best.is_feas else best.value.infeas),
+                ("mcts_simulations_total", "counter", "Simulations recorded", count),
+                ("mcts_infeasible_ratio", "gauge", "Ratio of infeasible simulations",
+                 sols.infeas_count / count if count > 0 else 0.0),
+                ("mcts_dual_bound", "gauge", "Global lower bound on the optimal value",
+                 sols.dual_bound),
+                ("mcts_gap_ratio", "gauge", "Relative optimality gap", sols.rel_gap),
+            ])
+        return metrics
+
+    def prometheus(self):
+        """Render the current metrics in Prometheus' text exposition format."""
+        lines = []
+        for name, kind, descr, value in self.metrics():
+            lines.append("# HELP {} {}".format(name, descr))
+            lines.append("# TYPE {} {}".format(name, kind))
+            lines.append("{} {!r}".format(name, float(value)))
+        return "\n".join(lines) + "\n"
+
+    def json(self):
+        """Render the current metrics as a JSON object."""
+        return json.dumps({name: value for name, _, _, value in self.metrics()}, sort_keys=True)
+
+
+def resident_set_size():
+    """Current resident set size of the process in bytes, or `None` if it cannot be determined.
+    Only Linux is supported (peak values are used as fallback on other unix systems).
+    """
+    try:
+        with open("/proc/self/statm", "rt") as statm:
+            return int(statm.read().split()[1]) * os.sysconf(str("SC_PAGE_SIZE"))
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+# Attributes of TreeNode objects which are managed by the framework (see TreeNode.__init__()).
+NODE_ATTRS = frozenset([
+    "path", "parent", "children", "expansion", "sim_count", "sim_sol", "sim_best", "bound_value",
+    "rng",
+])
+
+
+def deep_sizeof(obj, seen):
+    """Size in bytes of an object and of all objects reachable from it (as given by
+    :func:`gc.get_referents`) whose ids are not in the set `seen`, to which the ids of all
+    objects counted are added. Tree nodes, classes, modules and functions are not followed.
+    """
+    opaque = (TreeNode, type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+    size = 0
+    stack = [obj]
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, opaque):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+def memory_report(root, sols=None, sample_size=1000, rng_seed=0):
+    """Estimate how much memory a search tree takes, by category:
+
+    ``node_bytes``
+        framework overhead of the nodes (node objects and their attribute dicts, expansion
+        objects and children lists);
+    ``path_bytes``
+        the nodes' ``path`` tuples;
+    ``state_bytes``
+        problem-specific node attributes (objects shared by many nodes, like instance data, are
+        counted once);
+    ``solution_bytes``
+        solutions kept in the nodes and in `sols`, including their (possibly deferred) data.
+
+    The root is always measured, and the other nodes are estimated from a random sample of
+    `sample_size` nodes. The report also includes the number of nodes, the average bytes per
+    node, the resident set size of the process and, if :mod:`tracemalloc` is tracing, the
+    traced memory allocated by the framework, by the node class' module and elsewhere.
+
+    Returns:
+        dict mapping the names above to numbers of bytes (``None`` if unknown).
+    """
+    nodes = list(root.iter_subtree())
+    sample = nodes[1:]
+    if len(sample) > sample_size:
+        sample = random.Random(rng_seed).sample(sample, sample_size)
+    scale = (len(nodes) - 1) / len(sample) if len(sample) > 0 else 0.0
+    seen = set()
+    totals = dict.fromkeys(["node_bytes", "path_bytes", "state_bytes", "solution_bytes"], 0.0)
+    for node in [root] + sample:
+        weight = 1.0 if node is root else scale
+        node_attrs = vars(node)
+        node_bytes = sys.getsizeof(node) + sys.getsizeof(node_attrs)
+        node_bytes += sys.getsizeof(node.expansion) + sys.getsizeof(vars(node.expansion))
+        if node.children is not None:
+            node_bytes += sys.getsizeof(node.children)
+        state_bytes = sum(
+            deep_sizeof(value, seen)
+            for name, value in node_attrs.items() if name not in NODE_ATTRS
+        )
+        solution_bytes = sum(
+            deep_sizeof(sol, seen)
+            for sol in (node.sim_sol, node.sim_best) if sol is not None
+        )
+        totals["node_bytes"] += weight * node_bytes
+        totals["path_bytes"] += weight * sys.getsizeof(node.path)
+        totals["state_bytes"] += weight * state_bytes
+        totals["solution_bytes"] += weight * solution_bytes
+    if sols is not None:
+        totals["solution_bytes"] += sum(deep_sizeof(sol, seen) for sol in sols.list)
+    report = {name: int(size) for name, size in totals.items()}
+    report["total_bytes"] = sum(report.values())
+    report["nodes"] = len(nodes)
+    report["bytes_per_node"] = report["total_bytes"] / len(nodes)
+    report["rss"] = resident_set_size()
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        framework_file = sys.modules[__name__].__file__
+        user_file = getattr(sys.modules.get(type(root).__module__), "__file__", None)
+        traced = {"framework": 0, "user": 0, "other": 0}
+        for stat in tracemalloc.take_snapshot().statistics("filename"):
+            filename = stat.traceback[0].filename
+            category = (
+                "framework" if _same_source(filename, framework_file) else
+                "user" if user_file is not None and _same_source(filename, user_file) else
+                "other"
+            )
+            traced[category] += stat.size
+        for category, size in traced.items():
+            report["traced_{}_bytes".format(category)] = size
+    return report
+
+
+def _same_source(filename, module_file):
+    return os.path.splitext(filename)[0] == os.path.splitext(module_file)[0]
+
+
+class MemoryMonitor(object):
+    """Callback for :func:`run` (or :func:`run_bnb`) which samples the resident set size of the
+    process every `interval` iterations, and keeps the samples as (iteration, cpu time, bytes)
+    tuples in ``samples``. If a `limit` in bytes is given, `on_warning` is called as
+    ``on_warning(monitor, root, sols)`` the first time that memory use exceeds `warn_ratio` times
+    the limit (by default, a warning is logged with a :func:`memory_report` of the tree), and the
+    search is stopped once the limit itself is exceeded (unless `stop` is false).
+    """
+    def __init__(self, limit=None, warn_ratio=0.9, interval=1000, on_warning=None, stop=True):
+        self.limit = limit
+        self.warn_ratio = warn_ratio
+        self.interval = interval
+        self.on_warning = on_warning if on_warning is not None else type(self).log_warning
+        self.stop = stop
+        self.samples = []  # (iteration, cpu time, resident set size) tuples
+        self.peak = 0  # largest resident set size sampled
+        self.is_warned = False  # true after on_warning was called
+
+    def __call__(self, root, sols, i, t):
+        if i % self.interval != 0:
+            return False
+        rss = resident_set_size()
+        if rss is None:
+            return False
+        self.samples.append((i, t, rss))
+        self.peak = max(self.peak, rss)
+        if self.limit is None:
+            return False
+        if not self.is_warned and rss >= self.warn_ratio * self.limit:
+            self.is_warned = True
+            self.on_warning(self, root, sols)
+        if self.stop and rss >= self.limit:
+            warn("Memory limit reached ({:.0f} MiB)".format(rss / 2**20))
+            return True
+        return False
+
+    def log_warning(self, root, sols):
+        report = memory_report(root, sols)
+        warn("Memory use at {:.0f}% of the limit ({:.0f} MiB): {}".format(
+            100.0 * self.samples[-1][2] / self.limit, self.limit / 2**20,
+            ", ".join("{}={}".format(name, report[name]) for name in sorted(report))))
+
+
+def spawn_rngs(seed, n):
+    """Create `n` independent random number generators from a single seed, *e.g.* to give
+    each worker in a parallel search its own reproducible stream. The i-th generator is seeded
+    with a hash of `seed` and `i`, so the streams do not depend on the number of generators
+    created, and are practically independent from each other.
+    """
+    rngs = []
+    for i in range(n):
+        digest = hashlib.sha256("{!r}/{}".format(seed, i).encode("utf-8")).hexdigest()
+        rngs.append(random.Random(int(digest, 16)))
+    return rngs
+
+
 class Infeasible(object):
     """
     Infeasible objects can be compared with other objects (such as floats), but always compare as
@@ -163,15 +1108,47 @@ class Infeasible(object):
         return isinstance(obj, Infeasible) and self.infeas <= obj.infeas
 
 
+def value_key(value):
+    """Ordering key of a solution value: ``(0, value)`` for feasible values and ``(1, infeas)``
+    for :class:`Infeasible` ones. Keys compare like the values themselves, but through fast
+    native tuple comparisons, and both of their elements are plain numbers (*e.g.* to store them
+    in NumPy arrays).
+    """
+    if isinstance(value, Infeasible):
+        return (1, value.infeas)
+    return (0, value)
+
+
+solution_key = operator.attrgetter("key")
+
+
 class Solution(object):
     """Base class for solution objects. The :meth:`simulate` method of :class:`TreeNode` objects
     should return a :class:`Solution` object. Solutions can have solution data attached, but this
     is optional. The solution's value, however, is required.
+
+    Since most simulations do not produce improving solutions, building their data is often
+    wasted work (and memory, as solutions are kept in the tree's nodes). Instead of `data`, a
+    zero-argument callable `make_data` can be given, which is called only when the data is first
+    accessed or the solution becomes an incumbent. Ideally, this callable should hold a compact
+    recipe to rebuild the data (*e.g.* a seed or a sequence of branches), like so:
+
+    .. code-block:: python
+
+        def simulate(self):
+            seed = self.rng.getrandbits(32)
+            value = self.dive(seed)
+            return mcts.Solution(value=value, make_data=functools.partial(self.replay, seed))
+
+    The framework compares solutions through their ``key`` attribute (see :func:`value_key`),
+    which is computed on creation, so a solution's value should not be changed afterwards.
     """
-    def __init__(self, value, data=None):
+    def __init__(self, value, data=None, make_data=None):
         assert value is not None
         self.value = value  # objective function value (may be an Infeasible object)
-        self.data = data  # solution data
+        self._data = data  # solution data
+        self.make_data = make_data  # deferred solution data producer
+        self.key = value_key(value)  # ordering key used in all comparisons of solutions
         self.is_infeas = isinstance(value, Infeasible)  # infeasible solution flag
         self.is_feas = not self.is_infeas  # feasible solution flag
         self.is_opt = False  # optimal solution flag ("manually" set by run())
@@ -182,6 +1159,57 @@ class Solution(object):
     def __repr__(self):
         return "<{} @{:x}>".format(self, id(self))
 
+    @property
+    def data(self):
+        """Solution data, produced on first access if the solution was created with `make_data`."""
+        if self.make_data is not None:
+            self._data = self.make_data()
+            self.make_data = None
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.make_data = None
+
+    def materialize(self):
+        """Force production of any deferred solution data. Returns the solution itself."""
+        if self.make_data is not None:
+            self._data = self.make_data()
+            self.make_data = None
+        return self
+
+
+class Incumbent(collections.namedtuple(
+        str("Incumbent"), ["value", "cpu_time", "wall_time", "iteration", "tree_size"])):
+    """Record of a new best solution found during a search: its value, the cpu and wall time
+    elapsed since the start of the search, the number of iterations completed, and the number of
+    nodes in the tree at that point.
+    """
+    __slots__ = ()
+
+    def json(self):
+        """Render the record as a JSON object (infeasible values are given as ``"infeas"``)."""
+        record = self._asdict()
+        if isinstance(self.value, Infeasible):
+            record["value"] = None
+            record["infeas"] = self.value.infeas
+        return json.dumps(record, sort_keys=True)
+
+
+def primal_gap(value, reference):
+    """Primal gap of a solution value with respect to a reference (*e.g.* optimal) value, *i.e.*
+    ``|value - reference| / max(|value|, |reference|)``. The gap is 0 if both values are equal,
+    and 1 if the solution is infeasible or the values have opposite signs.
+    """
+    if value == reference:
+        return 0.0
+    if isinstance(value, Infeasible) or isinstance(reference, Infeasible):
+        return 1.0
+    if value * reference < 0:
+        return 1.0
+    return abs(value - reference) / max(abs(value), abs(reference))
+
 
 class Solutions(object):
     """Simple auxiliary object whose only responsibility is to keep track of best and worst
@@ -196,6 +1224,11 @@ class Solutions(object):
 
     def __init__(self, *sols):
         self.list = []  # Solution list (only keeps solutions that improve upper bound)
+        self.trajectory = []  # Incumbent records of the solutions in list (made during run())
+        self.trajectory_stream = None  # text stream where new Incumbent records are written
+        self.stats = None  # SearchStats of the running search, used to timestamp incumbents
+        self.dual_bound = -INF  # global lower bound on the optimal value (proven by the search)
+        self.shared_cutoff = INF  # best value found by other searches (see parallel.run_parallel())
         self.best = self.INIT_INFEAS_BEST  # best overall solution
         self.feas_count = 0  # number of feasible solutions seen
         self.feas_best = self.INIT_FEAS_BEST  # best feasible solution
@@ -215,6 +1248,16 @@ class Solutions(object):
     def __repr__(self):
         return "<{} @{:x}>".format(self, id(self))
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["stats"] = None  # the search statistics and stream stay in the current process
+        state["trajectory_stream"] = None
+        return state
+
+    @property
+    def count(self):
+        return self.feas_count + self.infeas_count
+
     @property
     def feas_ratio(self):
         return self.feas_count / (self.feas_count + self.infeas_count)
@@ -231,30 +1274,164 @@ class Solutions(object):
     def infeas_pct(self):
         return self.infeas_ratio * 100.0
 
+    @property
+    def abs_gap(self):
+        """Absolute optimality gap, *i.e.* the difference between the value of the best feasible
+        solution and the dual bound. This is infinite if no feasible solution is known.
+        """
+        if self.feas_count == 0:
+            return INF
+        return max(self.feas_best.value - self.dual_bound, 0.0)
+
+    @property
+    def rel_gap(self):
+        """Relative optimality gap, *i.e.* the absolute gap divided by the absolute value of the
+        best feasible solution (as reported by MIP solvers).
+        """
+        gap = self.abs_gap
+        if gap == 0.0 or gap == INF:
+            return gap
+        value = abs(self.feas_best.value)
+        return gap / value if value > 0.0 else INF
+
     def update(self, sol):
         # Update best and worst feasible solutions
         if sol.is_feas:
             self.feas_count += 1
-            if sol.value < self.feas_best.value:
+            if sol.key < self.feas_best.key:
                 debug("New best feasible solution: {} -> {}".format(self.feas_best, sol))
                 self.feas_best = sol
-            if sol.value > self.feas_worst.value:
+            if sol.key > self.feas_worst.key:
                 debug("New worst feasible solution: {} -> {}".format(self.feas_worst, sol))
                 self.feas_worst = sol
         # Update best and worst infeasible solutions
         else:
             self.infeas_count += 1
-            if sol.value < self.infeas_best.value:
+            if sol.key < self.infeas_best.key:
                 debug("New best infeasible solution: {} -> {}".format(self.infeas_best, sol))
                 self.infeas_best = sol
-            if sol.value > self.infeas_worst.value:
+            if sol.key > self.infeas_worst.key:
                 debug("New worst infeasible solution: {} -> {}".format(self.infeas_worst, sol))
                 self.infeas_worst = sol
         # Update best overall solution
-        if sol.value < self.best.value:
+        if sol.key < self.best.key:
             info("New best solution: {} -> {}".format(self.best, sol))
-            self.best = sol
-            self.list.append(sol)
+            self.best = sol.materialize()
+            self.add_incumbent(sol)
+
+    def merge(self, sols):
+        """Batched version of :meth:`update`. Integrates all statistics of another Solutions
+        object (*e.g.* obtained from :meth:`TreeNode.simulate_batch`) in a single step. Note that
+        only the best solution of `sols` is appended to the list of improving solutions.
+        """
+        # Update best and worst feasible solutions
+        if sols.feas_count > 0:
+            self.feas_count += sols.feas_count
+            if sols.feas_best.key < self.feas_best.key:
+                debug("New best feasible solution: {} -> {}".format(self.feas_best, sols.feas_best))
+                self.feas_best = sols.feas_best
+            if sols.feas_worst.key > self.feas_worst.key:
+                debug("New worst feasible solution: {} -> {}".format(
+                    self.feas_worst, sols.feas_worst))
+                self.feas_worst = sols.feas_worst
+        # Update best and worst infeasible solutions
+        if sols.infeas_count > 0:
+            self.infeas_count += sols.infeas_count
+            if sols.infeas_best.key < self.infeas_best.key:
+                debug("New best infeasible solution: {} -> {}".format(
+                    self.infeas_best, sols.infeas_best))
+                self.infeas_best = sols.infeas_best
+            if sols.infeas_worst.key > self.infeas_worst.key:
+                debug("New worst infeasible solution: {} -> {}".format(
+                    self.infeas_worst, sols.infeas_worst))
+                self.infeas_worst = sols.infeas_worst
+        # Update best overall solution
+        if sols.best.key < self.best.key:
+            info("New best solution: {} -> {}".format(self.best, sols.best))
+            self.best = sols.best.materialize()
+            self.add_incumbent(sols.best)
+        self.dual_bound = max(self.dual_bound, sols.dual_bound)
+
+    @property
+    def cutoff(self):
+        """Pruning cutoff for bounds, *i.e.* the value of the best feasible solution, or the
+        value in ``shared_cutoff`` if it is better. If no feasible solution is known, this is NaN,
+        so numeric bounds never prune anything (as comparisons of numbers with NaN are always
+        false). :class:`Infeasible` bounds, however, compare as greater than NaN like they do with
+        any number, so nodes whose subtrees are known to contain no feasible solution are still
+        pruned.
+        """
+        if self.feas_count > 0:
+            return min(self.feas_best.value, self.shared_cutoff)
+        return self.shared_cutoff if self.shared_cutoff < INF else float("nan")
+
+    def add_incumbent(self, sol):
+        """Append a new best solution to the list, along with an :class:`Incumbent` record of the
+        time, iteration and tree size at which it was found (if a search is running).
+        """
+        self.list.append(sol)
+        stats = self.stats
+        if stats is None:
+            return
+        record = Incumbent(
+            value=sol.value,
+            cpu_time=cpu_time() - stats.cpu_start,
+            wall_time=time.time() - stats.wall_start,
+            iteration=stats.iterations,
+            tree_size=stats.tree_size,
+        )
+        self.trajectory.append(record)
+        if self.trajectory_stream is not None:
+            self.trajectory_stream.write(record.json() + "\n")
+            self.trajectory_stream.flush()
+
+    def stream_trajectory(self, ostream):
+        """Write the records of all incumbents found so far to a text stream, and keep writing
+        new records (one JSON object per line) as soon as they are found.
+        """
+        for record in self.trajectory:
+            ostream.write(record.json() + "\n")
+        ostream.flush()
+        self.trajectory_stream = ostream
+
+    def time_to_target(self, target, clock="cpu_time"):
+        """Time at which the first solution with value not worse than `target` was found, or
+        `None` if no such solution was found. `clock` may be ``"cpu_time"`` or ``"wall_time"``.
+        """
+        for record in self.trajectory:
+            if record.value <= target:
+                return getattr(record, clock)
+        return None
+
+    def gap_curve(self, reference=None, clock="cpu_time"):
+        """Primal gap (see :func:`primal_gap`) of the incumbent over time, as a list of (time,
+        gap) points where the gap changes. The gap is 1 until the first incumbent is found. If no
+        `reference` value (*e.g.* the optimum) is given, the best solution's value is used.
+        """
+        if reference is None:
+            reference = self.best.value
+        curve = [(0.0, 1.0)]
+        for record in self.trajectory:
+            curve.append((getattr(record, clock), primal_gap(record.value, reference)))
+        return curve
+
+    def primal_integral(self, reference=None, horizon=None, clock="cpu_time"):
+        """Integral of the primal gap over time, from the start of the search to `horizon`
+        (Berthold, 2013). Lower values mean that good solutions were found earlier. By default,
+        the integral extends to the end of the search (or to the last incumbent, if the search
+        is unknown).
+        """
+        curve = self.gap_curve(reference, clock)
+        if horizon is None:
+            horizon = curve[-1][0] if self.stats is None else getattr(self.stats, clock)
+        integral = 0.0
+        for (t, gap), (t_next, _) in zip(curve, curve[1:] + [(horizon, None)]):
+            integral += gap * max(min(t_next, horizon) - t, 0.0)
+        return integral
+
+
+# Lists of released nodes available for recycling, per TreeNode subclass (see RECYCLE_LIMIT).
+_free_nodes = collections.defaultdict(list)
 
 
 class TreeNodeExpansion(object):
@@ -265,11 +1442,18 @@ class TreeNodeExpansion(object):
     method will return None and the 'is_finished' flag is set to true.
     """
     def __init__(self, node):
+        self.reset(node)
+
+    def reset(self, node):
+        """Reinitialize the expansion for `node` (*e.g.* when a node is recycled, see
+        :meth:`TreeNode.copy`). Returns the expansion itself.
+        """
         self.node = node
         self.branches = None
         self.next_branch = None
         self.is_started = False
         self.is_finished = False
+        return self
 
     def start(self):
         if self.is_started:
@@ -286,6 +1470,12 @@ class TreeNodeExpansion(object):
         self._advance_branch()
         return child
 
+    def skip(self):
+        """Discard the next branch without creating its child node."""
+        if self.is_finished:
+            raise ValueError("node expansion is already finished")
+        self._advance_branch()
+
     def _advance_branch(self):
         try:
             self.next_branch = next(self.branches)
@@ -310,6 +1500,17 @@ class TreeNode(object):
 
     Expansion = TreeNodeExpansion
 
+    # Random number generator used by the search and available to subclasses for simulation and
+    # branching decisions. The random module is only a fallback: run() assigns a per-search
+    # random.Random instance to every node in the tree (and nodes share it with their copies).
+    rng = random
+
+    # Maximum number of deleted nodes kept (per class) for reuse by copy(), which then skips the
+    # allocation of a new node object. Recycling is disabled by default, since it is only safe if
+    # no references to deleted nodes are kept outside the tree, and if copy() sets all
+    # problem-specific attributes of the clone.
+    RECYCLE_LIMIT = 0
+
     @classmethod
     def root(cls, instance):
         """Given a problem instance, create the root node for the associated search tree.
@@ -329,17 +1530,19 @@ class TreeNode(object):
         """
         raise NotImplementedError()
 
-    def __init__(self):
+    def __init__(self, expansion=None):
         cls = type(self)
         self.path = ()  # path from root down to, but excluding, 'self' (i.e. top-down ancestors)
         self.parent = None  # reference to parent node
         self.children = None  # list of child nodes (when expanded)
-        self.expansion = cls.Expansion(self)  # child node generator
+        # child node generator (a recycled node reuses its old expansion object, see copy())
+        self.expansion = cls.Expansion(self) if expansion is None else expansion.reset(self)
 
         # self.stats = cls.Stats(self)  # node statistics
         self.sim_count = 0  # number of simulations in this subtree
         self.sim_sol = None  # solution of this node's own simulation
         self.sim_best = None  # best solution of simulations in this subtree
+        self.bound_value = None  # cached result of bound() (computed when pruning)
 
     @property
     def depth(self):
@@ -356,6 +1559,16 @@ class TreeNode(object):
         """True iff the node is fully expanded and all its children were removed from the tree."""
         return self.is_expanded and len(self.children) == 0
 
+    def iter_subtree(self):
+        """Generate all nodes in the subtree rooted at this node (in depth-first order)."""
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            yield node
+            children = node.children
+            if children is not None:
+                stack.extend(reversed(children))
+
     def tree_size(self):
         stack = [self]
         count = 1
@@ -367,6 +1580,61 @@ class TreeNode(object):
                 count += len(children)
         return count
 
+    def make_root(self, release=True):
+        """Turn this node into the root of its own search tree, keeping its subtree and statistics.
+
+        This is meant for rolling-horizon use, where the decisions leading to this node are
+        committed and the search continues from the resulting state: calling :func:`run` on the
+        returned node continues searching its subtree instead of starting from scratch. The
+        paths (and depths) of all nodes in the subtree are updated accordingly. If `release` is
+        true, the rest of the old tree is dismantled (see :meth:`release`), so that its memory
+        is reclaimed immediately. In that case, the old tree must not be used afterwards.
+
+        Returns:
+            TreeNode: the node itself.
+        """
+        parent = self.parent
+        if parent is None:
+            return self
+        old_path = self.path
+        parent.children.remove(self)
+        self.parent = None
+        depth = len(old_path)
+        for node in self.iter_subtree():
+            node.path = node.path[depth:]
+        if release:
+            for node in list(old_path[0].iter_subtree()):
+                node.release()
+        return self
+
+    def release(self):
+        """Break the references held by a node which has been removed from the tree.
+
+        Nodes reference each other in cycles (parent and children, path tuples, and expansion
+        objects), so discarded nodes could otherwise only be reclaimed by Python's cyclic garbage
+        collector. A released node must not be used anymore, as it may be recycled by
+        :meth:`copy` (see ``RECYCLE_LIMIT``).
+        """
+        self.path = ()
+        self.parent = None
+        self.children = None
+        self.sim_sol = None
+        self.sim_best = None
+        expansion = self.expansion
+        expansion.node = None
+        expansion.branches = None
+        expansion.next_branch = None
+        cls = type(self)
+        if cls.RECYCLE_LIMIT > 0:
+            free_nodes = _free_nodes[cls]
+            if len(free_nodes) < cls.RECYCLE_LIMIT:
+                # Problem-specific attributes are dropped, so that nodes waiting to be recycled
+                # do not keep their state alive.
+                state = self.__dict__
+                for name in [name for name in state if name not in NODE_ATTRS]:
+                    del state[name]
+                free_nodes.append(self)
+
     def add_child(self, node):
         node.path = self.path + (self,)
         node.parent = self
@@ -393,8 +1661,14 @@ class TreeNode(object):
             TreeNode: a clone of the current node.
         """
         cls = type(self)
-        clone = cls.__new__(cls)
-        TreeNode.__init__(clone)
+        free_nodes = _free_nodes.get(cls)
+        if free_nodes:
+            clone = free_nodes.pop()
+            TreeNode.__init__(clone, clone.expansion)
+        else:
+            clone = cls.__new__(cls)
+            TreeNode.__init__(clone)
+        clone.rng = self.rng
         return clone
 
     def branches(self):
@@ -436,33 +1710,46 @@ class TreeNode(object):
     # children.
     SELECTION_ALLOW_INTERLEAVING = False
 
+    # Coefficient of the exploration term in selection_score(). Larger values favor exploration
+    # of less visited nodes, smaller values favor exploitation of nodes with good simulations.
+    SELECTION_EXPLORATION = 2.0
+
     # MCTS-related methods
-    def select(self, sols):
+    def select(self, sols, pruner=None):
         """Pick the most favorable node for exploration.
 
         This method starts at the root and descends until a leaf is found. In each level the child
-        to descend to is the one with the best selection score.
+        to descend to is the one with the best selection score. If a :class:`LazyPruner` is
+        given, dominated children are deleted as they are met during the descent.
         """
-        # Check if tree has been completely explored.
-        if self.is_exhausted:
-            return None
-        # Go down the tree picking the best child at each step.
-        curr_node = None
-        next_node = self
         allow_interleaving = self.SELECTION_ALLOW_INTERLEAVING
-        while next_node is not curr_node:
-            curr_node = next_node
-            curr_expansion = curr_node.expansion
-            if not curr_expansion.is_started:
-                break
-            if curr_expansion.is_finished:
-                cands = curr_node.children
-            elif allow_interleaving:
-                cands = itertools.chain(curr_node.children, [curr_node])
-            else:
+        while True:
+            # Check if tree has been completely explored.
+            if self.is_exhausted:
+                return None
+            # Go down the tree picking the best child at each step.
+            curr_node = None
+            next_node = self
+            restart = False
+            while next_node is not curr_node:
+                curr_node = next_node
+                curr_expansion = curr_node.expansion
+                if not curr_expansion.is_started:
+                    break
+                if pruner is not None and pruner.prune_children(curr_node):
+                    # the current node was deleted with its children, so we start over
+                    restart = True
+                    break
+                if curr_expansion.is_finished:
+                    cands = curr_node.children
+                elif allow_interleaving:
+                    cands = itertools.chain(curr_node.children, [curr_node])
+                else:
+                    break
+                best_cands = max_elems(cands, key=lambda n: n.selection_score(sols))
+                next_node = best_cands[0] if len(best_cands) == 1 else self.rng.choice(best_cands)
+            if not restart:
                 break
-            best_cands = max_elems(cands, key=lambda n: n.selection_score(sols))
-            next_node = best_cands[0] if len(best_cands) == 1 else random.choice(best_cands)
         # TODO: remove the debug lines below
         #     if curr_expansion.is_finished:
         #         print(".", end="")
@@ -481,16 +1768,15 @@ class TreeNode(object):
         See https://en.wikipedia.org/wiki/Monte_Carlo_tree_search. The exploitation term has been
         adapted to the optimization context, where there is no concept of win ratio.
         """
-        if self.sim_best.is_feas:
-            z_node = self.sim_best.value
-            z_best = sols.feas_best.value
-            z_worst = sols.feas_worst.value
+        is_infeas, z_node = self.sim_best.key
+        if not is_infeas:
+            z_best = sols.feas_best.key[1]
+            z_worst = sols.feas_worst.key[1]
             min_exploit = sols.infeas_count / (sols.feas_count + sols.infeas_count)
             max_exploit = 1.0
         else:
-            z_node = self.sim_best.value.infeas
-            z_best = sols.infeas_best.value.infeas
-            z_worst = sols.infeas_worst.value.infeas
+            z_best = sols.infeas_best.key[1]
+            z_worst = sols.infeas_worst.key[1]
             min_exploit = 0.0
             max_exploit = sols.infeas_count / (1 + sols.feas_count + sols.infeas_count)
         if z_best == z_worst:
@@ -501,7 +1787,7 @@ class TreeNode(object):
         exploit = min_exploit + raw_exploit * (max_exploit - min_exploit)
         explore = (
             INF if self.parent is None else
-            sqrt(2.0 * log(self.parent.sim_count) / self.sim_count)
+            sqrt(self.SELECTION_EXPLORATION * log(self.parent.sim_count) / self.sim_count)
         )
         expand = 1.0 / (1.0 + self.depth)
         return exploit + explore + expand
@@ -530,9 +1816,15 @@ class TreeNode(object):
         expansion_count = 0
         expansion_limit = self.EXPANSION_LIMIT
         while expansion_count < expansion_limit and not expansion.is_finished:
-            child = expansion.next()
-            if pruning and child.bound() >= cutoff:
+            if pruning and self.branch_bound(expansion.next_branch) >= cutoff:
+                expansion.skip()  # dominated branch, the child node is not even created
                 continue
+            child = expansion.next()
+            if pruning:
+                child.bound_value = child.bound()
+                if child.bound_value >= cutoff:
+                    child.release()
+                    continue
             self.add_child(child)
             new_children.append(child)
             expansion_count += 1
@@ -558,20 +1850,58 @@ class TreeNode(object):
         """
         raise NotImplementedError()
 
-    def backpropagate(self, sol):
+    def simulate_batch(self, n):
+        """Run `n` simulations from the current node and return a summary of their results.
+
+        This method is *optional*, and is only used when :func:`run` is called with
+        ``sim_batch_size > 1``. The default implementation simply calls :meth:`simulate` `n`
+        times. Subclasses whose simulations are cheap may override it to perform all `n`
+        simulations in a single vectorized computation (*e.g.* using NumPy), in which case only
+        the relevant solutions (best/worst) need to be materialized as :class:`Solution` objects.
+
+        Returns:
+            Solutions: object whose ``best`` attribute is the best solution of the batch, and
+            whose ``feas_count`` and ``infeas_count`` attributes add up to `n`.
+        """
+        return Solutions(*[self.simulate() for _ in range(n)])
+
+    def backpropagate(self, sol, count=1):
         """Integrate the solution obtained by this node's simulation into its subtree.
 
-        This updates sim_count and sim_best in all ancestor nodes.
+        This updates sim_count and sim_best in all ancestor nodes. If `sol` is the best solution
+        of a batch of simulations, `count` should be the number of simulations in the batch.
         """
         assert self.sim_count == 0
-        self.sim_count = 1
+        self.sim_count = count
         self.sim_sol = sol
         self.sim_best = sol
         for ancestor in self.path:
-            ancestor.sim_count += 1
-            if ancestor.sim_best.value > sol.value:
+            ancestor.sim_count += count
+            if ancestor.sim_best.key > sol.key:
                 ancestor.sim_best = sol
 
+    def backpropagate_children(self, children, results):
+        """Batched version of :meth:`backpropagate` for newly created children of this node,
+        where `results` holds a (best solution, simulation count) pair for each child. The
+        results are combined first, so that this node and its ancestors are updated only once.
+        """
+        total_count = 0
+        best = None
+        for child, (sol, count) in zip(children, results):
+            assert child.sim_count == 0
+            child.sim_count = count
+            child.sim_sol = sol
+            child.sim_best = sol
+            total_count += count
+            if best is None or sol.key < best.key:
+                best = sol
+        if best is None:
+            return
+        for ancestor in self.path + (self,):
+            ancestor.sim_count += total_count
+            if ancestor.sim_best.key > best.key:
+                ancestor.sim_best = best
+
     def delete(self):
         """Remove a leaf or an entire subtree from the search tree, updating its ancestors' stats.
 
@@ -579,7 +1909,20 @@ class TreeNode(object):
         all the nodes in its path, which is roughly equivalent to the opposite of backpropagate().
         Note that nodes in the path *must* be updated in bottom-up order.
         Note also that deletion of a node may trigger the deletion of its parent.
+
+        Returns:
+            int: the number of nodes removed from the tree (a root is kept as an exhausted node,
+                so it is never counted).
         """
+        deleted = list(self.iter_subtree())
+        removed = len(deleted)
+        if self.parent is None:
+            # Deleting the root empties the tree, leaving the root as an exhausted node.
+            for descendant in deleted[1:]:
+                descendant.release()
+            self.children = []
+            self.expansion.is_started = self.expansion.is_finished = True
+            return removed - 1  # (the root itself is kept)
         node = self
         while True:
             # Keep references to the path and parent since they'd be lost after remove_child().
@@ -595,25 +1938,40 @@ class TreeNode(object):
                 # New ancestor sim_best is the best of children's sim_best or its own sim_sol.
                 candidates = [child.sim_best for child in ancestor.children]
                 candidates.append(ancestor.sim_sol)
-                ancestor.sim_best = min(candidates, key=lambda s: s.value)
+                ancestor.sim_best = min(candidates, key=solution_key)
             # Propagate deletion to parent if it exists (true for all nodes except root) and has
             # become exhausted (i.e. is fully expanded and has no more children).
             if parent is None or not parent.is_exhausted:
                 break
             node = parent
+            if node.parent is not None:
+                removed += 1
+                deleted.append(node)  # (an exhausted root is kept, and not counted as removed)
+        # Break reference cycles so deleted nodes are freed immediately (this also marks them as
+        # deleted by setting their parent to None, see LazyPruner.sweep()).
+        for node in deleted:
+            node.release()
+        return removed
 
     # Branch-and-bound/pruning- related methods
     def prune(self, cutoff):
         """Called on the root node to prune off nodes/subtrees which can no longer lead to a
         solution better than the best solution found so far.
+
+        Returns:
+            int: the number of nodes removed from the tree.
         """
+        removed = 0
         stack = [self]
         while len(stack) > 0:
             node = stack.pop()
-            if node.bound() >= cutoff:
-                node.delete()
+            if node.bound_value is None:
+                node.bound_value = node.bound()
+            if node.bound_value >= cutoff:
+                removed += node.delete()
             elif node.is_expanded:
                 stack.extend(node.children)
+        return removed
 
     def bound(self):
         """Compute a lower bound on the current subtree's optimal objective value.
@@ -628,6 +1986,119 @@ class TreeNode(object):
         """
         raise NotImplementedError()
 
+    def branch_bound(self, branch):
+        """Compute a lower bound on the optimal objective value in the subtree of the child that
+        would be obtained by applying `branch` to this node, without creating the child.
+
+        This method is *optional*. When pruning, it is called by :meth:`expand` before each child
+        is created, and dominated branches are discarded without the cost of :meth:`copy` and
+        :meth:`apply`. It should therefore be much cheaper than :meth:`bound`, even if it is
+        less tight. The default implementation returns -inf, so every child is created (and its
+        :meth:`bound` is checked afterwards).
+        """
+        return -INF
+
+
+class LazyPruner(object):
+    """Pruning strategy that avoids sweeping the whole tree every time the best solution
+    improves. Instead, dominated nodes (whose cached bound is not better than the cutoff) are
+    deleted when :meth:`TreeNode.select` meets them, and memory is reclaimed gradually by a
+    background sweep, which visits a fixed number of nodes in each call to :meth:`sweep`.
+    """
+    def __init__(self, root, cutoff=INF, sweep_size=100):
+        self.root = root
+        self.cutoff = cutoff
+        self.sweep_size = sweep_size
+        self.removed = 0  # number of nodes removed (reset by the caller)
+        self.stack = []  # nodes still to be visited by the background sweep
+        self.is_dirty = False  # true if the cutoff changed since the current sweep started
+
+    def set_cutoff(self, cutoff):
+        self.cutoff = cutoff
+        if len(self.stack) == 0:
+            self.stack.append(self.root)
+        else:
+            self.is_dirty = True  # restart once the current sweep is done
+
+    def is_dominated(self, node):
+        bound = node.bound_value
+        return bound is not None and bound >= self.cutoff
+
+    def prune_children(self, node):
+        """Delete the dominated children of `node`. Returns true iff `node` itself was deleted
+        as a consequence (*i.e.* it became exhausted), or if it is the root and became exhausted.
+        """
+        if node.children is None:
+            return False
+        dominated = [child for child in node.children if self.is_dominated(child)]
+        for child in dominated:
+            self.removed += child.delete()
+        if node is self.root:
+            return node.is_exhausted  # the root is never deleted
+        return node.parent is None
+
+    def sweep(self):
+        """Visit the next `sweep_size` nodes of the background sweep, deleting dominated ones."""
+        root = self.root
+        stack = self.stack
+        budget = self.sweep_size
+        while budget > 0:
+            if len(stack) == 0:
+                if not self.is_dirty:
+                    break
+                stack.append(root)
+                self.is_dirty = False
+            node = stack.pop()
+            budget -= 1
+            if node.parent is None and node is not root:
+                continue  # node has already been deleted
+            if self.is_dominated(node):
+                self.removed += node.delete()
+            elif node.children is not None:
+                stack.extend(node.children)
+
+
+class DualBound(object):
+    """Incremental tracker of the global lower (dual) bound of a search with pruning, *i.e.* the
+    lowest cached bound among the nodes of the tree which are not fully expanded (as these cover
+    all the branches not yet in the tree). Open nodes are kept in a heap, and those which have
+    since been expanded or deleted are discarded lazily when they reach its top.
+    """
+    def __init__(self, root):
+        self.heap = []  # (bound, counter, expansion) triples
+        self.counter = itertools.count()
+        self.compact_size = 1024  # heap size that triggers the next compaction
+        self.add_all(root.iter_subtree())
+
+    @staticmethod
+    def is_open(expansion):
+        return expansion.node is not None and not expansion.is_finished
+
+    def add_all(self, nodes):
+        heap = self.heap
+        for node in nodes:
+            if node.expansion.is_finished:
+                continue
+            if node.bound_value is None:
+                node.bound_value = node.bound()
+            heapq.heappush(heap, (node.bound_value, next(self.counter), node.expansion))
+        if len(heap) > self.compact_size:
+            # drop stale entries, so that memory use is proportional to the number of open nodes
+            heap[:] = [entry for entry in heap if self.is_open(entry[2])]
+            heapq.heapify(heap)
+            self.compact_size = max(2 * len(heap), 1024)
+
+    def value(self, cutoff):
+        """The global lower bound, given the value of the best feasible solution (or NaN)."""
+        heap = self.heap
+        while len(heap) > 0:
+            bound, _, expansion = heap[0]
+            if self.is_open(expansion):
+                return bound if not bound >= cutoff else cutoff
+            heapq.heappop(heap)
+        # the tree is exhausted: the best solution is optimal, or the problem is infeasible
+        return cutoff if cutoff == cutoff else INF
+
 
 def max_elems(iterable, key=None):
     """Find the elements in 'iterable' corresponding to the maximum values w.r.t. 'key'."""
@@ -672,3 +2143,10 @@ def config_logging(name=__name__, level="INFO"):
             },
         }
     })
+
+
+if __name__ == "__main__":
+    # Use the modules through their regular import names, so that node classes and the framework
+    # share the same TreeNode class (which is not the case with the __main__ module).
+    from rr.opt.mcts import tools
+    sys.exit(tools.main())
@@ -0,0 +1,552 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future.builtins import object, range
+
+import argparse
+import array
+import ast
+import glob
+import importlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from math import erf, isinf, isnan, sqrt
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from rr.opt.mcts.simple import INF, Infeasible, SearchStats, config_logging, cpu_time, run
+
+
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+
+
+class MetricsServer(object):
+    """Publish the statistics of a search over HTTP, in Prometheus' text format, from a local
+    endpoint served by a background (daemon) thread. Example:
+
+    .. code-block:: python
+
+        stats = mcts.SearchStats()
+        server = tools.MetricsServer(stats, port=9100).start()
+        mcts.run(root, stats=stats)
+        server.stop()
+
+    Metrics are computed only when the endpoint is requested, so the search itself is unaffected
+    by the server apart from the (small) cost of the requests.
+    """
+    def __init__(self, stats, port=9100, host="127.0.0.1"):
+        self.stats = stats
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        stats = self.stats
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = stats.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header(str("Content-Type"), str("text/plain; version=0.0.4"))
+                self.send_header(str("Content-Length"), str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # keep scrapes out of stderr
+
+        self.server = HTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]  # actual port (if port 0 was requested)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mcts-metrics")
+        self.thread.daemon = True
+        self.thread.start()
+        info("Serving metrics at http://{}:{}/metrics".format(self.host, self.port))
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class MetricsFile(object):
+    """Periodically rewrite a file with the statistics of a search, from a background (daemon)
+    thread. The file is replaced atomically, and contains either Prometheus' text format (*e.g.*
+    for node_exporter's textfile collector) or a JSON object, if `fmt` is ``"json"``.
+    """
+    def __init__(self, stats, filepath, interval=10.0, fmt="prometheus"):
+        self.stats = stats
+        self.filepath = filepath
+        self.interval = interval
+        self.fmt = fmt
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, name="mcts-metrics-file")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+
+    def write(self):
+        text = self.stats.json() + "\n" if self.fmt == "json" else self.stats.prometheus()
+        tmp_filepath = self.filepath + ".tmp"
+        with open(tmp_filepath, "wt") as ostream:
+            ostream.write(text)
+        getattr(os, "replace", os.rename)(tmp_filepath, self.filepath)
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+
+# Columns of tree snapshots written by export_tree(), with their array module typecodes.
+TREE_SNAPSHOT_COLUMNS = [
+    ("id", "l"),  # node id (nodes are numbered in depth-first order)
+    ("parent", "l"),  # id of the parent node (-1 for the root of the snapshot)
+    ("depth", "l"),  # depth of the node in the tree
+    ("sim_count", "l"),  # number of simulations in the node's subtree
+    ("best_value", "d"),  # value of sim_best if it is feasible, otherwise NaN
+    ("best_infeas", "d"),  # infeasibility of sim_best if it is infeasible, otherwise NaN
+    ("bound", "d"),  # cached bound (NaN if the bound was never computed, inf if infeasible)
+    ("expansion", "b"),  # expansion state (0: not started, 1: expanding, 2: expanded)
+    ("num_children", "l"),  # number of children currently in the tree
+]
+
+
+def export_tree(root, filepath, chunk_size=65536):
+    """Write a snapshot of the tree under `root` to a file in NumPy's ``.npz`` format, with one
+    array per column in :data:`TREE_SNAPSHOT_COLUMNS` and one row per node.
+
+    The tree is walked only once, and rows are written in chunks of `chunk_size` nodes to
+    temporary column files, so memory usage is bounded regardless of the size of the tree. NumPy
+    is *not* required to write snapshots, but is the easiest way to load them (with
+    ``numpy.load()``). To take snapshots in the middle of a search, call this function from a
+    callback (see :func:`.run`), *e.g.*:
+
+    .. code-block:: python
+
+        def snapshot(root, sols, i, t):
+            if i % 100000 == 0:
+                tools.export_tree(root, "tree-{}.npz".format(i))
+
+        mcts.run(root, callbacks=[snapshot])
+
+    Returns:
+        int: the number of nodes written.
+    """
+    nan = float("nan")
+    tmpdir = tempfile.mkdtemp(prefix="mcts-snapshot-")
+    try:
+        files = [open(os.path.join(tmpdir, name), "w+b") for name, _ in TREE_SNAPSHOT_COLUMNS]
+        for f in files:
+            f.write(b"\0" * NPY_HEADER_SIZE)  # placeholder, rewritten when the length is known
+        chunks = [array.array(typecode) for _, typecode in TREE_SNAPSHOT_COLUMNS]
+        (ids, parents, depths, sim_counts, best_values, best_infeas, bounds,
+         expansions, num_children) = chunks
+        count = 0
+        stack = [(root, -1)]
+        while len(stack) > 0:
+            node, parent_id = stack.pop()
+            ids.append(count)
+            parents.append(parent_id)
+            depths.append(node.depth)
+            sim_counts.append(node.sim_count)
+            sim_best = node.sim_best
+            if sim_best is None:
+                best_values.append(nan)
+                best_infeas.append(nan)
+            elif sim_best.is_feas:
+                best_values.append(sim_best.value)
+                best_infeas.append(nan)
+            else:
+                best_values.append(nan)
+                best_infeas.append(sim_best.value.infeas)
+            bound = node.bound_value
+            bounds.append(nan if bound is None else INF if isinstance(bound, Infeasible) else bound)
+            expansion = node.expansion
+            expansions.append(2 if expansion.is_finished else 1 if expansion.is_started else 0)
+            children = node.children
+            num_children.append(0 if children is None else len(children))
+            if children is not None:
+                stack.extend((child, count) for child in reversed(children))
+            count += 1
+            if len(ids) >= chunk_size:
+                for f, chunk in zip(files, chunks):
+                    chunk.tofile(f)
+                    del chunk[:]
+        with zipfile.ZipFile(filepath, "w", allowZip64=True) as zf:
+            for f, chunk, (name, typecode) in zip(files, chunks, TREE_SNAPSHOT_COLUMNS):
+                chunk.tofile(f)
+                f.seek(0)
+                f.write(npy_header(typecode, count))
+                f.close()
+                zf.write(f.name, arcname=name + ".npy")
+    finally:
+        shutil.rmtree(tmpdir)
+    return count
+
+
+NPY_HEADER_SIZE = 128  # fixed size of the .npy headers written by npy_header()
+
+
+def npy_header(typecode, length):
+    """Build the header of a ``.npy`` file (format version 1.0) containing a one-dimensional
+    array of `length` items of the given :mod:`array` typecode, padded to a fixed size.
+    """
+    itemsize = array.array(typecode).itemsize
+    kind = "f" if typecode in "fd" else "i"
+    byteorder = "|" if itemsize == 1 else "<" if sys.byteorder == "little" else ">"
+    header = "{{'descr': '{}{}{}', 'fortran_order': False, 'shape': ({},), }}".format(
+        byteorder, kind, itemsize, length,
+    )
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def load_class(path):
+    """Import a class given its path, as ``"package.module:Class"`` or ``"package.module.Class"``.
+    Class objects are returned unchanged.
+    """
+    if not isinstance(path, str):
+        return path
+    module_name, _, class_name = path.rpartition(":" if ":" in path else ".")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def configure_node_class(node_class, config):
+    """Create a subclass of `node_class` with the class attributes in `config` overridden.
+    Only upper case keys (*e.g.* ``EXPANSION_LIMIT``) are considered class attributes.
+    """
+    attrs = {key: value for key, value in config.items() if key.isupper()}
+    if len(attrs) == 0:
+        return node_class
+    return type(str(node_class.__name__), (node_class,), attrs)
+
+
+def run_experiment(node_class, instance, config=None, seed=None, **run_kwargs):
+    """Run a single search and summarize its outcome in a JSON-serializable dict.
+
+    Arguments:
+        node_class: a :class:`.TreeNode` subclass, or the path to one (see :func:`load_class`).
+        instance: the argument passed to ``node_class.root()`` (*e.g.* a file path).
+        config (dict): parameters of the search. Upper case keys override class attributes of
+            `node_class` (*e.g.* ``EXPANSION_LIMIT`` or ``SELECTION_EXPLORATION``), and all other
+            keys are passed as keyword arguments to :func:`.run` (*e.g.* ``pruning``).
+        seed: seed for the search's random number generator.
+        run_kwargs: additional keyword arguments for :func:`.run`.
+    """
+    config = dict(config or {})
+    node_class = configure_node_class(load_class(node_class), config)
+    run_kwargs.update((key, value) for key, value in config.items() if not key.isupper())
+    stats = SearchStats(phase_timing=False)
+    t0 = cpu_time()
+    root = node_class.root(instance)
+    sols = run(root, rng_seed=seed, stats=stats, **run_kwargs)
+    best = sols.best
+    last = sols.trajectory[-1] if len(sols.trajectory) > 0 else None
+    return {
+        "instance": instance if isinstance(instance, (str, int, float)) else None,
+        "seed": seed,
+        "config": config,
+        "value": best.value if best.is_feas else None,
+        "infeas": None if best.is_feas else best.value.infeas,
+        "is_opt": best.is_opt,
+        "time": stats.cpu_time,
+        "total_time": cpu_time() - t0,
+        "time_to_best": last.cpu_time if last is not None else None,
+        "iter_to_best": last.iteration if last is not None else None,
+        "iterations": stats.iterations,
+        "tree_size_peak": stats.tree_size_peak,
+    }
+
+
+def _run_experiment_job(job):
+    node_class, instance, config, seed, run_kwargs = job
+    return run_experiment(node_class, instance, config, seed, **run_kwargs)
+
+
+def result_key(result):
+    """Sort key for results of :func:`run_experiment` (feasible first, then by value)."""
+    if result["value"] is not None:
+        return (0, result["value"])
+    return (1, result["infeas"])
+
+
+def rank(results):
+    """Compute the ranks (starting at 1, ties get the average rank) of a list of results."""
+    keys = [result_key(result) for result in results]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    ranks = [0.0] * len(keys)
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and keys[order[end]] == keys[order[start]]:
+            end += 1
+        for k in range(start, end):
+            ranks[order[k]] = (start + end + 1) / 2.0  # average of ranks start+1..end
+        start = end
+    return ranks
+
+
+def normal_quantile(p):
+    """Inverse of the standard normal cumulative distribution function (by bisection)."""
+    lo, hi = -10.0, 10.0
+    for _ in range(100):
+        mid = (lo + hi) / 2.0
+        if 0.5 * (1.0 + erf(mid / sqrt(2.0))) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2.0
+
+
+def race(node_class, instances, configs, seeds=(0,), processes=None, alpha=0.05,
+         min_blocks=5, **run_kwargs):
+    """Tune the parameters of a search by racing candidate configurations.
+
+    Each *block* of the race is a pair (instance, seed), on which all surviving configurations
+    are run (see :func:`run_experiment`) in a pool of worker processes (which starts on the
+    following blocks whenever workers would otherwise be idle). Configurations are ranked within
+    each block, and after `min_blocks` blocks, any configuration whose mean rank is
+    significantly worse than the best mean rank is eliminated. The test is the normal
+    approximation of the post-hoc test for the Friedman rank sums, with a Bonferroni correction
+    for the number of comparisons. Since search time is usually fixed through a `time_limit`
+    (passed to :func:`.run` in `run_kwargs`), configurations are compared only by the value of
+    the best solution found.
+
+    Arguments:
+        node_class: a :class:`.TreeNode` subclass, or its path (see :func:`load_class`).
+        instances: list of (picklable) arguments for ``node_class.root()``.
+        configs: list of candidate configurations (dicts, see :func:`run_experiment`).
+        seeds: seeds with which each instance is solved.
+        processes (int): size of the process pool (defaults to the number of cpus).
+        alpha (float): significance level of the elimination test.
+        min_blocks (int): number of blocks that must be completed before eliminations start.
+
+    Returns:
+        A list of dicts (one per configuration) with keys ``config``, ``alive``, ``blocks`` and
+        ``mean_rank``, where the best configuration comes first.
+    """
+    blocks = [(instance, seed) for seed in seeds for instance in instances]
+    processes = processes or multiprocessing.cpu_count()
+    alive = list(range(len(configs)))
+    results = [[] for _ in configs]  # results[c][b] is the result of config c on block b
+    completed = 0  # number of blocks completed by all surviving configurations
+    submitted = 0  # number of blocks whose jobs were submitted to the pool
+    pending = {}  # (block, config) -> AsyncResult
+    pool = multiprocessing.Pool(processes)
+    try:
+        while completed < len(blocks) and len(alive) > 1:
+            while True:
+                # Keep the whole pool busy by running the following blocks ahead of eliminations
+                # (jobs of configurations eliminated meanwhile are wasted, but idle time is not).
+                while (submitted < len(blocks) and
+                       sum(not job.ready() for job in pending.values()) < processes):
+                    instance, seed = blocks[submitted]
+                    for c in alive:
+                        job = (node_class, instance, configs[c], seed, run_kwargs)
+                        pending[submitted, c] = pool.apply_async(_run_experiment_job, (job,))
+                    submitted += 1
+                running = [c for c in alive if not pending[completed, c].ready()]
+                if len(running) == 0:
+                    break
+                pending[completed, running[0]].wait(0.1)
+            for c in alive:
+                results[c].append(pending.pop((completed, c)).get())
+            completed += 1
+            if completed < min_blocks:
+                continue
+            mean_ranks = _mean_ranks(results, alive, completed)
+            best_rank = min(mean_ranks.values())
+            n = len(alive)
+            z_critical = normal_quantile(1.0 - alpha / (n - 1))
+            std_err = sqrt(n * (n + 1) / (6.0 * completed))
+            losers = [c for c in alive if (mean_ranks[c] - best_rank) / std_err > z_critical]
+            for c in losers:
+                info("Race: eliminated config {} after {} blocks (mean rank {:.2f} vs {:.2f})"
+                     .format(configs[c], completed, mean_ranks[c], best_rank))
+            alive = [c for c in alive if c not in losers]
+            for key in [key for key in pending if key[1] in losers]:
+                del pending[key]
+    finally:
+        pool.terminate()
+        pool.join()
+    mean_ranks = _mean_ranks(results, alive, completed)
+    summary = []
+    for c, config in enumerate(configs):
+        summary.append({
+            "config": config,
+            "alive": c in alive,
+            "blocks": len(results[c]),
+            "mean_rank": mean_ranks.get(c),
+        })
+    summary.sort(key=lambda r: (not r["alive"], r["mean_rank"] or 0.0, -r["blocks"]))
+    info("Race: best config is {}".format(summary[0]["config"]))
+    return summary
+
+
+def _mean_ranks(results, alive, completed):
+    rank_sums = dict.fromkeys(alive, 0.0)
+    for b in range(completed):
+        for c, r in zip(alive, rank([results[c][b] for c in alive])):
+            rank_sums[c] += r
+    return {c: rank_sums[c] / max(completed, 1) for c in alive}
+
+
+def parse_grid(params):
+    """Parse a list of ``"NAME=V1,V2,..."`` strings into a list of configurations (dicts) with
+    all combinations of values. Values are parsed as Python literals whenever possible.
+    """
+    names = []
+    choices = []
+    for param in params:
+        name, _, values = param.partition("=")
+        names.append(name.strip())
+        choices.append([_parse_literal(value.strip()) for value in values.split(",")])
+    return [dict(zip(names, values)) for values in itertools.product(*choices)]
+
+
+def _parse_literal(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        pass
+    try:
+        return float(text)  # also accepts "inf" and "nan"
+    except ValueError:
+        return text
+
+
+def parse_seeds(text):
+    """Parse a seed list such as ``"0-9"`` or ``"1,2,5"`` (or a combination of both)."""
+    seeds = []
+    for part in text.split(","):
+        first, sep, last = part.partition("-")
+        seeds.extend(range(int(first), int(last) + 1) if sep else [int(first)])
+    return seeds
+
+
+def _limit_memory(max_bytes):
+    # Worker initializer for main(). Exceeding the limit raises MemoryError within the job.
+    if max_bytes is not None:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def _json_safe(value):
+    # Standard JSON has no Infinity/NaN, so non-finite floats are written as strings that
+    # parse back through float() (as the command line accepts them).
+    if isinstance(value, float) and (isinf(value) or isnan(value)):
+        return repr(value)
+    if isinstance(value, dict):
+        return {key: _json_safe(elem) for key, elem in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(elem) for elem in value]
+    return value
+
+
+def _run_cli_job(job):
+    node_class, instance, config, seed, run_kwargs, wall_limit = job
+    if wall_limit < INF:
+        deadline = time.time() + wall_limit
+        run_kwargs = dict(run_kwargs)
+        run_kwargs["callbacks"] = [lambda root, sols, i, t: time.time() >= deadline]
+    try:
+        result = run_experiment(node_class, instance, config, seed, **run_kwargs)
+    except (Exception, MemoryError) as error:
+        result = {
+            "instance": instance,
+            "seed": seed,
+            "config": config,
+            "error": "{}: {}".format(type(error).__name__, error),
+        }
+    result["node_class"] = node_class
+    return result
+
+
+def main(argv=None):
+    """Batch experiment runner, available as ``python -m rr.opt.mcts.simple``. Runs a search for
+    every combination of instance, configuration (from a parameter grid) and seed in a pool of
+    worker processes, and writes one line of JSON per search (see :func:`run_experiment`).
+    Non-finite numbers are written as the strings ``"inf"``, ``"-inf"`` and ``"nan"``.
+
+    The time limit of each job is in cpu time (see :func:`.run`), which does not advance while
+    the job waits for a cpu, so a wall clock limit can also be given (it is checked once per
+    iteration, so it cannot interrupt the root's setup or a single long iteration).
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m rr.opt.mcts.simple",
+        description="Run MCTS over instance x configuration x seed combinations.",
+    )
+    parser.add_argument("node_class", help="TreeNode subclass, as package.module:Class")
+    parser.add_argument("instances", nargs="+", help="instance files (glob patterns allowed)")
+    parser.add_argument("-p", "--param", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="parameter grid entry: upper case names set class attributes, "
+                             "others are passed to run() (may be repeated)")
+    parser.add_argument("-s", "--seeds", default="0", help="seeds, e.g. 0-9 or 1,2,5")
+    parser.add_argument("-t", "--time-limit", type=float, default=INF,
+                        help="cpu time limit per run (seconds)")
+    parser.add_argument("-w", "--wall-limit", type=float, default=INF,
+                        help="wall clock time limit per run (seconds, checked every iteration)")
+    parser.add_argument("-i", "--iter-limit", type=float, default=INF,
+                        help="iteration limit per run")
+    parser.add_argument("-m", "--memory-limit", type=float, default=None,
+                        help="address space limit per run (MB)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: number of cpus)")
+    parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the workers")
+    args = parser.parse_args(argv)
+
+    instances = []
+    for pattern in args.instances:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            warn("Pattern {!r} matches no files, using it as an instance".format(pattern))
+            matches = [pattern]
+        instances.extend(matches)
+    run_kwargs = {"time_limit": args.time_limit, "iter_limit": args.iter_limit}
+    jobs = [
+        (args.node_class, instance, config, seed, run_kwargs, args.wall_limit)
+        for instance in instances
+        for config in parse_grid(args.param)
+        for seed in parse_seeds(args.seeds)
+    ]
+    config_logging("rr.opt.mcts", level=args.log_level)
+    max_bytes = None if args.memory_limit is None else int(args.memory_limit * 2**20)
+    ostream = sys.stdout if args.output == "-" else open(args.output, "at")
+    # Each job runs in a fresh worker, so memory limits and leftovers do not leak between jobs.
+    pool = multiprocessing.Pool(args.jobs, _limit_memory, (max_bytes,), maxtasksperchild=1)
+    try:
+        for result in pool.imap_unordered(_run_cli_job, jobs):
+            ostream.write(json.dumps(_json_safe(result), sort_keys=True, allow_nan=False) + "\n")
+            ostream.flush()
+    finally:
+        pool.close()
+        pool.join()
+        if ostream is not sys.stdout:
+            ostream.close()
+    return 0